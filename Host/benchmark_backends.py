@@ -0,0 +1,137 @@
+#******************************************************************************
+# Compares the EventLoop of pylib_async with the MultitaskEventLoop of        *
+# pylib_multitask on a PC with the virtual clock.                            *
+#******************************************************************************
+import argparse, json, os, platform, sys, time
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+PYBRICKS_DIR = os.path.join(os.path.dirname(HOST_DIR), "Pybricks")
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(1, PYBRICKS_DIR)
+
+import host_runtime
+
+s_virtual_clock = host_runtime.VirtualClock()
+host_runtime.setup(s_virtual_clock, host_runtime.ScriptedStdin([]))
+
+import pylib_async
+from pylib_async import EventLoop, WaitForIntervalMs, WaitForTaskCompletedMs
+from pylib_bg_logger import clean_bg_log_messages
+from pylib_motor import calibrate_motor_task, decalibrate_motor_task
+from pylib_multitask import MultitaskEventLoop
+from pylib_railroad_switch import Position, switch_task
+from pylib_telemetry import disable_telemetry
+from pybricks.parameters import Port
+from pybricks.pupdevices import Motor
+
+pylib_async.set_clock(s_virtual_clock)
+
+TASK_COUNTS = [10, 100]
+PERIODIC_ITERATIONS = 100
+SLEEP_TIME_MS = 10000
+MOTOR_ROUNDS = 10
+
+class Counter:
+
+    def __init__(self):
+        self.activations = 0
+
+# Task that is woken every 10 ms.
+def periodic_task(counter, iterations):
+    timer = WaitForIntervalMs(10)
+    for i in range(iterations):
+        yield timer
+        counter.activations += 1
+    return None
+
+# Task that sleeps while the periodic task is running.
+def sleeping_task(counter):
+    yield SLEEP_TIME_MS
+    counter.activations += 1
+    return None
+
+# Runs the motor tasks of 4 motors one after another.
+def motor_rounds_task(event_loop, counter, motors):
+    for i in range(MOTOR_ROUNDS):
+        for index in range(len(motors)):
+            name = "motor_" + str(index)
+            event_loop.register_task(switch_task(motors[index], name, Position.A), name + "_switch")
+            yield WaitForTaskCompletedMs(name + "_switch")
+            yield decalibrate_motor_task(motors[index], name)
+            yield calibrate_motor_task(motors[index], name)
+            counter.activations += 3
+        clean_bg_log_messages()
+    return None
+
+def periodic_workload(event_loop, counter, task_count):
+    for i in range(task_count):
+        event_loop.register_task(periodic_task(counter, PERIODIC_ITERATIONS), "periodic_" + str(i))
+
+def sleeping_workload(event_loop, counter, task_count):
+    for i in range(task_count):
+        event_loop.register_task(sleeping_task(counter), "sleeping_" + str(i))
+    event_loop.register_task(periodic_task(counter, SLEEP_TIME_MS // 10 - 1), "periodic")
+
+def motor_workload(event_loop, counter, task_count):
+    motors = [Motor(Port.A), Motor(Port.B), Motor(Port.C), Motor(Port.D)]
+    event_loop.register_task(motor_rounds_task(event_loop, counter, motors), "motor_rounds")
+
+def create_event_loop(backend, task_count):
+    if backend == "multitask":
+        # the slots are sized to the registered tasks
+        return MultitaskEventLoop()
+    return EventLoop()
+
+# Runs a workload and returns the wall time and the time per activation.
+def run_workload(backend, workload, task_count):
+    event_loop = create_event_loop(backend, task_count)
+    counter = Counter()
+    workload(event_loop, counter, task_count)
+    hub_start_time = s_virtual_clock.time_ms()
+    start_time = time.perf_counter()
+    event_loop.run_tickless_ms(poll_time_ms=10)
+    wall_time_us = (time.perf_counter() - start_time) * 1000000
+    return {"wall_ms": round(wall_time_us / 1000, 3),
+            "hub_ms": s_virtual_clock.time_ms() - hub_start_time,
+            "activations": counter.activations,
+            "activation_us": round(wall_time_us / max(counter.activations, 1), 3)}
+
+def run_benchmarks():
+    workloads = [("periodic", periodic_workload, TASK_COUNTS),
+                 ("sleeping", sleeping_workload, TASK_COUNTS),
+                 ("motors", motor_workload, [1])]
+    results = {}
+    for backend in ["event_loop", "multitask"]:
+        backend_results = {}
+        for workload_name, workload, task_counts in workloads:
+            for task_count in task_counts:
+                case_name = workload_name + "_" + str(task_count)
+                backend_results[case_name] = run_workload(backend, workload, task_count)
+        results[backend] = backend_results
+    ratios = {}
+    for case_name in results["event_loop"]:
+        event_loop_time = results["event_loop"][case_name]["activation_us"]
+        multitask_time = results["multitask"][case_name]["activation_us"]
+        ratios[case_name] = round(multitask_time / event_loop_time, 3)
+    return {
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": results,
+        "multitask_vs_event_loop": ratios,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the EventLoop backends.")
+    parser.add_argument("--output", help="writes the results as JSON into the file")
+    args = parser.parse_args()
+    disable_telemetry()
+    results = run_benchmarks()
+    results_text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(results_text + "\n")
+    else:
+        print(results_text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+#******************************************************************************
+# Scalability benchmarks of the pylib_async EventLoop on a PC with CPython.   *
+#******************************************************************************
+import argparse, json, os, platform, sys, time, tracemalloc
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+PYBRICKS_DIR = os.path.join(os.path.dirname(HOST_DIR), "Pybricks")
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(1, PYBRICKS_DIR)
+
+import host_runtime
+
+s_virtual_clock = host_runtime.VirtualClock()
+s_host_stdin = host_runtime.ScriptedStdin([])
+host_runtime.setup(s_virtual_clock, s_host_stdin)
+
+import pylib_async
+from pylib_async import (NOT_REACHED, EventLoop, WaitFor, WaitForAbsoluteTime,
+                         WaitForAbsoluteTimeMs, WaitForAll, WaitForAny, WaitForIntervalMs, WaitForPeriodMs,
+                         WaitForRelativeTime, WaitForRelativeTimeMs,
+                         WaitForTaskCompleted, WaitForTaskCompletedMs)
+
+pylib_async.set_clock(s_virtual_clock)
+
+TASK_COUNTS = [1, 10, 100, 1000, 10000]
+QUICK_TASK_COUNTS = [1, 10, 100, 1000]
+# Number of task activations that are measured per result.
+ACTIVATION_BUDGET = 100000
+MIN_TICKS = 20
+MAX_TICKS = 2000
+REPEATS = 3
+CONDITION_TASKS = 100
+ALLOCATION_TASKS = 100
+ALLOCATION_TICKS = 1000
+LATENCY_ITERATIONS = 100
+LATENCY_LOAD_TASKS = 100
+HOUR_MS = 3600000
+
+# Condition that is never reached, it is tested on each loop pass.
+class WaitForNever(WaitFor):
+
+    def test_event(self, event_loop):
+        return NOT_REACHED
+
+def perf_time_us():
+    return time.perf_counter_ns() // 1000
+
+def ticks_for(activations_per_tick):
+    if activations_per_tick <= 0:
+        return MAX_TICKS
+    return max(MIN_TICKS, min(MAX_TICKS, ACTIVATION_BUDGET // activations_per_tick))
+
+# Runs loop passes and returns the time [us] per pass, the virtual clock is
+# advanced by advance_ms per pass. The best of the repeats is taken.
+def measure_ticks(event_loop, ticks, advance_ms=0):
+    best_time_us = None
+    for repeat in range(REPEATS):
+        start_time_us = perf_time_us()
+        tick = 0
+        while tick < ticks:
+            if advance_ms > 0:
+                s_virtual_clock.advance_to(s_virtual_clock.time_ms() + advance_ms)
+            event_loop.process_next_events()
+            tick += 1
+        tick_time_us = (perf_time_us() - start_time_us) / ticks
+        if best_time_us is None or tick_time_us < best_time_us:
+            best_time_us = tick_time_us
+    return round(best_time_us, 3)
+
+# Task that sleeps longer than the benchmark is running.
+def sleeping_task():
+    yield WaitForRelativeTimeMs(HOUR_MS)
+    return None
+
+# Task that is runnable in each loop pass.
+def ready_task():
+    while True:
+        yield 0
+
+# Task that waits for the completion of another task.
+def waiting_task(task_name):
+    yield WaitForTaskCompletedMs(task_name)
+    return None
+
+# Tick cost of an idle loop pass with sleeping tasks in the timers.
+def benchmark_sleeping_tasks(task_counts):
+    results = {}
+    for task_count in task_counts:
+        event_loop = EventLoop()
+        for i in range(task_count):
+            event_loop.register_task(sleeping_task(), "sleeping_task_" + str(i))
+        event_loop.process_next_events()
+        results[str(task_count)] = {"tick_us": measure_ticks(event_loop, MAX_TICKS)}
+    return results
+
+# Tick cost of a loop pass in which all tasks are activated.
+def benchmark_ready_tasks(task_counts):
+    results = {}
+    for task_count in task_counts:
+        event_loop = EventLoop()
+        for i in range(task_count):
+            event_loop.register_task(ready_task(), "ready_task_" + str(i))
+        event_loop.process_next_events()
+        tick_us = measure_ticks(event_loop, ticks_for(task_count))
+        results[str(task_count)] = {"tick_us": tick_us,
+                                    "activation_us": round(tick_us / task_count, 3)}
+    return results
+
+# Tick cost of an idle loop pass with tasks waiting for the completion of a
+# sleeping task, and the cost of waking all of them when the task finishes.
+def benchmark_task_completed_waiters(task_counts):
+    results = {}
+    for task_count in task_counts:
+        event_loop = EventLoop()
+        event_loop.register_task(sleeping_task(), "sleeping_task")
+        for i in range(task_count):
+            event_loop.register_task(waiting_task("sleeping_task"), "waiting_task_" + str(i))
+        event_loop.process_next_events()
+        tick_us = measure_ticks(event_loop, MAX_TICKS)
+        s_virtual_clock.advance_to(s_virtual_clock.time_ms() + HOUR_MS)
+        start_time_us = perf_time_us()
+        while event_loop.task_count > 0:
+            event_loop.process_next_events()
+        wake_all_us = perf_time_us() - start_time_us
+        results[str(task_count)] = {"tick_us": tick_us, "wake_all_us": wake_all_us}
+    return results
+
+# Tasks that wait in a loop for one of the conditions, each condition is
+# reached after 1 ms. The counter counts the wake-ups.
+class ConditionTasks:
+
+    def __init__(self, condition_name):
+        self.condition_name = condition_name
+        self.wake_ups = 0
+        self.next_child = 0
+
+    def task(self, event_loop):
+        name = self.condition_name
+        interval = WaitForIntervalMs(1)
+        period = WaitForPeriodMs(1)
+        while True:
+            if name == "WaitForAbsoluteTimeMs":
+                yield WaitForAbsoluteTimeMs(pylib_async.time_ms() + 1)
+            elif name == "WaitForRelativeTimeMs":
+                yield WaitForRelativeTimeMs(1)
+            elif name == "WaitForIntervalMs":
+                yield interval
+            elif name == "WaitForPeriodMs":
+                yield period
+            elif name == "sleep_ms":
+                yield 1
+            elif name == "WaitForAbsoluteTime":
+                yield WaitForAbsoluteTime(pylib_async.time_time() + 0.001)
+            elif name == "WaitForRelativeTime":
+                yield WaitForRelativeTime(0.001)
+            elif name == "WaitForTaskCompletedMs":
+                child_name = self.register_child(event_loop)
+                yield WaitForTaskCompletedMs(child_name, 1000)
+            elif name == "WaitForTaskCompleted":
+                child_name = self.register_child(event_loop)
+                yield WaitForTaskCompleted(child_name, 1.0)
+            elif name == "WaitForAny":
+                yield WaitForAny(WaitForRelativeTimeMs(1000), interval)
+            elif name == "WaitForAll":
+                yield WaitForAll(WaitForRelativeTimeMs(1), interval)
+            self.wake_ups += 1
+
+    def register_child(self, event_loop):
+        child_name = "child_" + str(self.next_child)
+        self.next_child += 1
+        event_loop.register_task(self.child_task(), child_name)
+        return child_name
+
+    def child_task(self):
+        yield 1
+        return None
+
+CONDITION_NAMES = ["WaitForAbsoluteTimeMs", "WaitForRelativeTimeMs", "WaitForIntervalMs",
+                   "WaitForPeriodMs", "sleep_ms", "WaitForAbsoluteTime", "WaitForRelativeTime",
+                   "WaitForTaskCompletedMs", "WaitForTaskCompleted", "WaitForAny", "WaitForAll"]
+
+# Cost of a wake-up per condition: the tasks are woken each millisecond.
+def benchmark_conditions():
+    results = {}
+    for condition_name in CONDITION_NAMES:
+        event_loop = EventLoop()
+        condition_tasks = ConditionTasks(condition_name)
+        for i in range(CONDITION_TASKS):
+            event_loop.register_task(condition_tasks.task(event_loop), "condition_task_" + str(i))
+        event_loop.process_next_events()
+        ticks = ticks_for(CONDITION_TASKS)
+        start_time_us = perf_time_us()
+        wake_ups_before = condition_tasks.wake_ups
+        tick = 0
+        while tick < ticks:
+            s_virtual_clock.advance_to(s_virtual_clock.time_ms() + 1)
+            event_loop.process_next_events()
+            tick += 1
+        elapsed_us = perf_time_us() - start_time_us
+        wake_ups = condition_tasks.wake_ups - wake_ups_before
+        results[condition_name] = {"tick_us": round(elapsed_us / ticks, 3),
+                                   "wake_up_us": round(elapsed_us / max(wake_ups, 1), 3)}
+    return results
+
+# Returns the allocated bytes per loop pass: the net growth of the memory and
+# the average of the temporary peaks within a pass.
+def measure_allocations(event_loop, ticks, advance_ms):
+    tracemalloc.start()
+    try:
+        peak_sum = 0
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tick = 0
+        while tick < ticks:
+            if advance_ms > 0:
+                s_virtual_clock.advance_to(s_virtual_clock.time_ms() + advance_ms)
+            tracemalloc.reset_peak()
+            tick_start_memory = tracemalloc.get_traced_memory()[0]
+            event_loop.process_next_events()
+            peak_sum += tracemalloc.get_traced_memory()[1] - tick_start_memory
+            tick += 1
+        net_memory = tracemalloc.get_traced_memory()[0] - start_memory
+    finally:
+        tracemalloc.stop()
+    return {"net_bytes_per_tick": round(net_memory / ticks, 3),
+            "peak_bytes_per_tick": round(peak_sum / ticks, 3)}
+
+def interval_task():
+    timer = WaitForIntervalMs(1)
+    while True:
+        yield timer
+
+def period_task():
+    period = WaitForPeriodMs(1)
+    while True:
+        yield period
+
+def polling_task():
+    yield WaitForNever()
+    return None
+
+# Allocations per loop pass, an idle pass shall allocate nothing.
+def benchmark_allocations():
+    scenarios = [
+        ("idle", [sleeping_task, polling_task], 0),
+        ("ready", [ready_task], 0),
+        ("interval", [interval_task], 1),
+        ("period", [period_task], 1),
+    ]
+    results = {}
+    for scenario_name, task_functions, advance_ms in scenarios:
+        event_loop = EventLoop()
+        for i in range(ALLOCATION_TASKS):
+            task_function = task_functions[i % len(task_functions)]
+            event_loop.register_task(task_function(), "task_" + str(i))
+        # warm up: the lists of the event loop reach their final size
+        for i in range(10):
+            s_virtual_clock.advance_to(s_virtual_clock.time_ms() + advance_ms)
+            event_loop.process_next_events()
+        results[scenario_name] = measure_allocations(event_loop, ALLOCATION_TICKS, advance_ms)
+    return results
+
+# Time [us] of the real clock since its start.
+def real_time_us(clock):
+    return (time.monotonic() - clock.start_time) * 1000000
+
+# Task that waits with a condition repeatedly and records the lateness [us]
+# of each wake-up versus the wake time of the condition.
+def latency_task(event_loop, clock, condition_name, latencies):
+    interval = WaitForIntervalMs(3)
+    period = WaitForPeriodMs(4)
+    for iteration in range(LATENCY_ITERATIONS):
+        wait_time_ms = 2 + iteration % 5
+        if condition_name == "WaitForAbsoluteTimeMs":
+            condition = WaitForAbsoluteTimeMs(pylib_async.time_ms() + wait_time_ms)
+            yield condition
+        elif condition_name == "WaitForRelativeTimeMs":
+            condition = WaitForRelativeTimeMs(wait_time_ms)
+            yield condition
+        elif condition_name == "WaitForIntervalMs":
+            condition = interval
+            yield condition
+        elif condition_name == "WaitForPeriodMs":
+            condition = period
+            yield condition
+        elif condition_name == "sleep_ms":
+            condition = WaitForAbsoluteTimeMs(pylib_async.time_ms() + wait_time_ms)
+            yield wait_time_ms
+        elif condition_name == "WaitForAbsoluteTime":
+            condition = WaitForAbsoluteTime(pylib_async.time_time() + wait_time_ms / 1000)
+            yield condition
+        elif condition_name == "WaitForRelativeTime":
+            condition = WaitForRelativeTime(wait_time_ms / 1000)
+            yield condition
+        elif condition_name == "WaitForAny":
+            condition = WaitForRelativeTimeMs(wait_time_ms)
+            yield WaitForAny(WaitForRelativeTimeMs(1000), condition)
+        elif condition_name == "WaitForAll":
+            condition = WaitForRelativeTimeMs(wait_time_ms)
+            yield WaitForAll(WaitForRelativeTimeMs(1), condition)
+        elif condition_name == "WaitForTaskCompletedMs" or condition_name == "WaitForTaskCompleted":
+            finish_times = []
+            child_name = condition_name + "_child"
+            event_loop.register_task(latency_child_task(clock, wait_time_ms, finish_times), child_name)
+            if condition_name == "WaitForTaskCompletedMs":
+                yield WaitForTaskCompletedMs(child_name, 1000)
+            else:
+                yield WaitForTaskCompleted(child_name, 1.0)
+            latencies.append(real_time_us(clock) - finish_times[0])
+            continue
+        latencies.append(real_time_us(clock) - condition.absolute_time_ms * 1000)
+    return None
+
+def latency_child_task(clock, wait_time_ms, finish_times):
+    yield wait_time_ms
+    finish_times.append(real_time_us(clock))
+    return None
+
+# Stops the event loop when the latency tasks are finished.
+def latency_stop_task(event_loop, task_names):
+    for task_name in task_names:
+        yield WaitForTaskCompletedMs(task_name)
+    event_loop.cancel_all()
+    return None
+
+def percentile(sorted_values, fraction):
+    index = int(fraction * (len(sorted_values) - 1) + 0.5)
+    return sorted_values[index]
+
+def distribution(values):
+    sorted_values = sorted(values)
+    return {"count": len(sorted_values),
+            "mean_us": round(sum(sorted_values) / len(sorted_values), 1),
+            "p50_us": round(percentile(sorted_values, 0.5), 1),
+            "p90_us": round(percentile(sorted_values, 0.9), 1),
+            "p99_us": round(percentile(sorted_values, 0.99), 1),
+            "max_us": round(sorted_values[-1], 1)}
+
+# Wake-up latency with the real clock: the loop runs tickless with sleeping
+# and polled tasks as load, the latency is measured per condition.
+def benchmark_wake_latency():
+    real_clock = host_runtime.RealClock()
+    host_runtime.setup(real_clock, s_host_stdin)
+    pylib_async.set_clock(real_clock)
+    try:
+        event_loop = EventLoop()
+        for i in range(LATENCY_LOAD_TASKS):
+            event_loop.register_task(sleeping_task(), "sleeping_task_" + str(i))
+        latencies_map = {}
+        task_names = []
+        for condition_name in CONDITION_NAMES:
+            latencies_map[condition_name] = []
+            task_name = "latency_task_" + condition_name
+            event_loop.register_task(latency_task(event_loop, real_clock, condition_name,
+                                                  latencies_map[condition_name]), task_name)
+            task_names.append(task_name)
+        event_loop.register_task(latency_stop_task(event_loop, task_names), "latency_stop_task")
+        event_loop.run_tickless_ms(poll_time_ms=10)
+    finally:
+        host_runtime.setup(s_virtual_clock, s_host_stdin)
+        pylib_async.set_clock(s_virtual_clock)
+    results = {}
+    all_latencies = []
+    for condition_name in CONDITION_NAMES:
+        results[condition_name] = distribution(latencies_map[condition_name])
+        all_latencies += latencies_map[condition_name]
+    results["all"] = distribution(all_latencies)
+    return results
+
+def run_benchmarks(quick):
+    task_counts = QUICK_TASK_COUNTS if quick else TASK_COUNTS
+    return {
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": {
+            "sleeping_tasks": benchmark_sleeping_tasks(task_counts),
+            "ready_tasks": benchmark_ready_tasks(task_counts),
+            "task_completed_waiters": benchmark_task_completed_waiters(task_counts),
+            "conditions": benchmark_conditions(),
+            "allocations": benchmark_allocations(),
+            "wake_latency": benchmark_wake_latency(),
+        },
+    }
+
+# The maximum latency depends on the scheduling of the PC, it is only reported.
+NOT_COMPARED_METRICS = ("count", "max_us")
+
+# Returns the compared metrics as {"group.case.metric": value}.
+def flatten(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and key not in NOT_COMPARED_METRICS:
+            metrics[prefix + key] = value
+    return metrics
+
+# Compares the results with the baseline, all metrics are "lower is better".
+# A metric is a regression when it exceeds baseline * tolerance + slack.
+# Returns the number of regressions.
+def compare(results, baseline, tolerance, slack):
+    metrics = flatten(results["benchmarks"])
+    baseline_metrics = flatten(baseline["benchmarks"])
+    print("baseline:", baseline.get("python"), baseline.get("machine"))
+    print("%-60s %12s %12s %8s" % ("metric", "baseline", "current", "ratio"))
+    regressions = 0
+    for name in sorted(metrics):
+        value = metrics[name]
+        if name not in baseline_metrics:
+            print("%-60s %12s %12s %8s" % (name, "-", value, "new"))
+            continue
+        baseline_value = baseline_metrics[name]
+        ratio = "-"
+        if baseline_value > 0:
+            ratio = "%.2f" % (value / baseline_value)
+        marker = ""
+        if value > baseline_value * tolerance + slack:
+            marker = "  REGRESSION"
+            regressions += 1
+        print("%-60s %12s %12s %8s%s" % (name, baseline_value, value, ratio, marker))
+    print("regressions =", regressions)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the pylib_async EventLoop.")
+    parser.add_argument("--output", help="writes the results as JSON into the file")
+    parser.add_argument("--baseline", help="compares the results with the JSON file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="writes the results into the baseline file")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="allowed factor versus the baseline (default 2.0)")
+    parser.add_argument("--slack", type=float, default=1.0,
+                        help="allowed absolute difference versus the baseline (default 1.0)")
+    parser.add_argument("--quick", action="store_true", help="omits the largest task count")
+    args = parser.parse_args()
+    results = run_benchmarks(args.quick)
+    results_text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(results_text + "\n")
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            baseline_file.write(results_text + "\n")
+        print("baseline saved:", args.baseline)
+    elif args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.tolerance, args.slack) > 0:
+            sys.exit(1)
+    elif not args.output:
+        print(results_text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#******************************************************************************
+# Runtime for the hub programs on a PC with CPython.                          *
+#******************************************************************************
+import os, select, sys, time
+
+POLLIN = 1
+
+# Raised by the clock when the time limit of the run is reached.
+class TimeLimitReached(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+# Raised by the virtual clock when a program waits for input that never comes.
+class NoMoreEvents(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+# Clock with virtual time: sleeping fast-forwards the time immediately, so
+# hours of hub time are simulated in milliseconds.
+class VirtualClock:
+
+    def __init__(self, time_limit_ms=None):
+        self.now_ms = 0
+        self.time_limit_ms = time_limit_ms
+
+    def time_ms(self):
+        return self.now_ms
+
+    def sleep_ms(self, sleep_time_ms):
+        if sleep_time_ms > 0:
+            self.advance_to(self.now_ms + int(sleep_time_ms))
+
+    # Waits until input is available or the timeout [ms] is over (None: no
+    # timeout).
+    def wait_input_ms(self, host_stdin, timeout_ms):
+        wake_time = None
+        if timeout_ms is not None:
+            wake_time = self.now_ms + int(timeout_ms)
+        input_time = host_stdin.next_input_time()
+        if input_time is not None and (wake_time is None or input_time < wake_time):
+            wake_time = input_time
+        if wake_time is None:
+            raise NoMoreEvents(self.now_ms)
+        self.advance_to(wake_time)
+
+    def advance_to(self, time_ms):
+        if self.time_limit_ms is not None and time_ms > self.time_limit_ms:
+            self.now_ms = self.time_limit_ms
+            raise TimeLimitReached(self.now_ms)
+        if time_ms > self.now_ms:
+            self.now_ms = time_ms
+
+# Clock with the real time of the PC.
+class RealClock:
+
+    def __init__(self, time_limit_ms=None):
+        self.start_time = time.monotonic()
+        self.time_limit_ms = time_limit_ms
+
+    def time_ms(self):
+        now_ms = int((time.monotonic() - self.start_time) * 1000)
+        if self.time_limit_ms is not None and now_ms > self.time_limit_ms:
+            raise TimeLimitReached(now_ms)
+        return now_ms
+
+    def sleep_ms(self, sleep_time_ms):
+        if sleep_time_ms > 0:
+            time.sleep(sleep_time_ms / 1000)
+
+    def wait_input_ms(self, host_stdin, timeout_ms):
+        host_stdin.wait_input_ms(timeout_ms)
+
+# Stdin that delivers scripted commands at given times [ms]. The commands are
+# terminated with "\r" like the commands of the PC console.
+class ScriptedStdin:
+
+    def __init__(self, commands):
+        # list of (time [ms], command line), ordered by time
+        self.commands = sorted(commands, key=lambda command: command[0])
+        self.data = b""
+        self.buffer = self
+
+    def next_input_time(self):
+        if len(self.data) > 0:
+            return s_clock.time_ms()
+        if len(self.commands) > 0:
+            return self.commands[0][0]
+        return None
+
+    def input_ready(self):
+        self.fetch_commands()
+        return len(self.data) > 0
+
+    def fetch_commands(self):
+        now_ms = s_clock.time_ms()
+        while len(self.commands) > 0 and self.commands[0][0] <= now_ms:
+            self.data += (self.commands.pop(0)[1] + "\r").encode("utf-8")
+
+    # Sleeps in real time until input is available or the timeout [ms] is over.
+    def wait_input_ms(self, timeout_ms):
+        sleep_time_ms = timeout_ms
+        input_time = self.next_input_time()
+        if input_time is not None:
+            input_wait_time_ms = input_time - s_clock.time_ms()
+            if sleep_time_ms is None or input_wait_time_ms < sleep_time_ms:
+                sleep_time_ms = input_wait_time_ms
+        if sleep_time_ms is None:
+            raise NoMoreEvents(s_clock.time_ms())
+        if sleep_time_ms > 0:
+            time.sleep(sleep_time_ms / 1000)
+
+    def read(self, size=-1):
+        self.fetch_commands()
+        if size < 0:
+            size = len(self.data)
+        data = self.data[:size]
+        self.data = self.data[size:]
+        return data
+
+# Stdin of the PC console, a newline is translated into "\r".
+class ConsoleStdin:
+
+    def __init__(self):
+        self.file_number = sys.stdin.fileno()
+        self.buffer = self
+
+    def next_input_time(self):
+        return None
+
+    def input_ready(self):
+        return len(select.select([self.file_number], [], [], 0)[0]) > 0
+
+    def wait_input_ms(self, timeout_ms):
+        if timeout_ms is None:
+            select.select([self.file_number], [], [])
+        else:
+            select.select([self.file_number], [], [], timeout_ms / 1000)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = 1024
+        return os.read(self.file_number, size).replace(b"\n", b"\r")
+
+s_clock = VirtualClock()
+s_stdin = ScriptedStdin([])
+
+# Installs the clock and the stdin, must be called before the program starts.
+def setup(clock, host_stdin):
+    global s_clock, s_stdin
+    s_clock = clock
+    s_stdin = host_stdin
+
+def clock():
+    return s_clock
+
+def stdin():
+    return s_stdin
+
+# Polls the streams like uselect.poll().poll(timeout_ms).
+def poll_streams(streams, timeout_ms):
+    ready_streams = [(stream, POLLIN) for stream in streams if stream.input_ready()]
+    if len(ready_streams) > 0 or timeout_ms == 0:
+        return ready_streams
+    if timeout_ms is not None and timeout_ms < 0:
+        timeout_ms = None
+    s_clock.wait_input_ms(s_stdin, timeout_ms)
+    return [(stream, POLLIN) for stream in streams if stream.input_ready()]
@@ -0,0 +1,3 @@
+#******************************************************************************
+# Stand-in for the Pybricks package on a PC.                                  *
+#******************************************************************************
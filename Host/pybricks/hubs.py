@@ -0,0 +1,13 @@
+#******************************************************************************
+# Stand-in for pybricks.hubs on a PC.                                         *
+#******************************************************************************
+
+class System:
+
+    def name(self):
+        return "Host Hub"
+
+class ThisHub:
+
+    def __init__(self):
+        self.system = System()
@@ -0,0 +1,11 @@
+#******************************************************************************
+# Stand-in for pybricks.parameters on a PC.                                   *
+#******************************************************************************
+
+class Port:
+    A = "A"
+    B = "B"
+    C = "C"
+    D = "D"
+    E = "E"
+    F = "F"
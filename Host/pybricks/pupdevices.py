@@ -0,0 +1,80 @@
+#******************************************************************************
+# Stand-in for pybricks.pupdevices on a PC with a simulated motor.            *
+#******************************************************************************
+import host_runtime
+
+# Simulated motor: the angle follows the speed over the host runtime time.
+class Motor:
+
+    def __init__(self, port):
+        self.port = port
+        self.current_angle = 0.0
+        self.current_speed = 0
+        self.target_angle = None
+        self.update_time = host_runtime.clock().time_ms()
+
+    # Moves the motor up to the current time.
+    def update_state(self):
+        now_ms = host_runtime.clock().time_ms()
+        elapsed_ms = now_ms - self.update_time
+        self.update_time = now_ms
+        if self.current_speed == 0 or elapsed_ms <= 0:
+            return
+        delta_angle = self.current_speed * elapsed_ms / 1000
+        if self.target_angle is not None:
+            remaining_angle = self.target_angle - self.current_angle
+            if abs(delta_angle) >= abs(remaining_angle):
+                # target reached: the motor holds the position
+                self.current_angle = self.target_angle
+                self.current_speed = 0
+                self.target_angle = None
+                return
+        self.current_angle += delta_angle
+
+    def angle(self):
+        self.update_state()
+        return int(round(self.current_angle))
+
+    def speed(self):
+        self.update_state()
+        return self.current_speed
+
+    def reset_angle(self, angle=None):
+        self.update_state()
+        if angle is None:
+            # absolute position in the range -180...179
+            angle = ((self.current_angle + 180) % 360) - 180
+        if self.target_angle is not None:
+            self.target_angle += angle - self.current_angle
+        self.current_angle = angle
+
+    def run(self, speed):
+        self.update_state()
+        self.target_angle = None
+        self.current_speed = speed
+
+    def run_target(self, speed, target_angle, then=None, wait=True):
+        self.update_state()
+        if target_angle == self.current_angle:
+            self.current_speed = 0
+            return
+        self.target_angle = target_angle
+        if target_angle > self.current_angle:
+            self.current_speed = abs(speed)
+        else:
+            self.current_speed = -abs(speed)
+        if wait:
+            run_time_ms = abs(target_angle - self.current_angle) * 1000 / abs(speed)
+            host_runtime.clock().sleep_ms(int(run_time_ms) + 1)
+            self.update_state()
+
+    def stop(self):
+        self.update_state()
+        self.current_speed = 0
+        self.target_angle = None
+
+    def brake(self):
+        self.stop()
+
+    def hold(self):
+        self.stop()
@@ -0,0 +1,104 @@
+#******************************************************************************
+# Stand-in for pybricks.tools on a PC, the time is the host runtime clock.    *
+#******************************************************************************
+import host_runtime
+
+s_run_task_active = False
+s_next_wake_time = None
+
+# Awaitable of wait() inside run_task(). Like in the firmware the awaiting
+# coroutine is suspended at least once.
+class WaitAwaitable:
+
+    def __init__(self, time):
+        self.wake_time = host_runtime.clock().time_ms() + int(time)
+
+    def __await__(self):
+        global s_next_wake_time
+        while True:
+            if s_next_wake_time is None or self.wake_time < s_next_wake_time:
+                s_next_wake_time = self.wake_time
+            yield
+            if host_runtime.clock().time_ms() >= self.wake_time:
+                return None
+
+# Awaitable of multitask(): runs the coroutines round robin until all are
+# finished (race=False) or the first is finished (race=True). Like in the
+# firmware awaitables (e.g. wait()) can be given as well.
+class MultitaskAwaitable:
+
+    def __init__(self, coroutines, race):
+        self.coroutines = [coroutine if hasattr(coroutine, "send") else coroutine.__await__()
+                           for coroutine in coroutines]
+        self.race = race
+
+    def __await__(self):
+        results = [None] * len(self.coroutines)
+        running = list(range(len(self.coroutines)))
+        while True:
+            for index in list(running):
+                try:
+                    self.coroutines[index].send(None)
+                except StopIteration as ex:
+                    results[index] = ex.value
+                    running.remove(index)
+                    if self.race:
+                        for other_index in running:
+                            self.coroutines[other_index].close()
+                        return results
+            if len(running) == 0:
+                return results
+            yield
+
+# Inside run_task() wait() returns an awaitable, otherwise it blocks.
+def wait(time):
+    if s_run_task_active:
+        return WaitAwaitable(time)
+    host_runtime.clock().sleep_ms(time)
+
+def multitask(*coroutines, race=False):
+    return MultitaskAwaitable(coroutines, race)
+
+# Runs the coroutine, between the rounds the clock sleeps until the earliest
+# wake time of the awaited waits.
+def run_task(coroutine):
+    global s_run_task_active, s_next_wake_time
+    s_run_task_active = True
+    if not hasattr(coroutine, "send"):
+        coroutine = coroutine.__await__()
+    try:
+        while True:
+            s_next_wake_time = None
+            try:
+                coroutine.send(None)
+            except StopIteration as ex:
+                return ex.value
+            if s_next_wake_time is not None:
+                host_runtime.clock().sleep_ms(s_next_wake_time - host_runtime.clock().time_ms())
+    finally:
+        s_run_task_active = False
+
+class StopWatch:
+
+    def __init__(self):
+        self.start_time = host_runtime.clock().time_ms()
+        self.pause_time = None
+
+    def time(self):
+        if self.pause_time is not None:
+            return self.pause_time - self.start_time
+        return host_runtime.clock().time_ms() - self.start_time
+
+    def pause(self):
+        if self.pause_time is None:
+            self.pause_time = host_runtime.clock().time_ms()
+
+    def resume(self):
+        if self.pause_time is not None:
+            self.start_time += host_runtime.clock().time_ms() - self.pause_time
+            self.pause_time = None
+
+    def reset(self):
+        self.start_time = host_runtime.clock().time_ms()
+        if self.pause_time is not None:
+            self.pause_time = self.start_time
@@ -0,0 +1,59 @@
+#******************************************************************************
+# Runs a hub program on a PC with CPython.                                    *
+#******************************************************************************
+import argparse, os, runpy, sys, time
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Reads a script with lines "<time [ms]> <command line>".
+def read_script(script_file_name):
+    commands = []
+    with open(script_file_name, "r") as script_file:
+        for line in script_file:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            time_text, _, command_line = line.partition(" ")
+            commands.append((int(time_text), command_line))
+    return commands
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a hub program on a PC.")
+    parser.add_argument("program", help="hub program, e.g. ../Pybricks/Pybricks_simulation.py")
+    parser.add_argument("--real-time", action="store_true",
+                        help="use the real time and the console as stdin")
+    parser.add_argument("--script", help="file with lines <time [ms]> <command line>")
+    parser.add_argument("--command", action="append", default=[],
+                        help="scripted command <time [ms]> <command line>")
+    parser.add_argument("--until", type=int, help="time limit [ms]")
+    args = parser.parse_args()
+    sys.path.insert(0, HOST_DIR)
+    sys.path.insert(1, os.path.dirname(os.path.abspath(args.program)))
+    import host_runtime
+    if args.real_time:
+        clock = host_runtime.RealClock(args.until)
+        host_stdin = host_runtime.ConsoleStdin()
+    else:
+        commands = []
+        if args.script:
+            commands += read_script(args.script)
+        for command in args.command:
+            time_text, _, command_line = command.partition(" ")
+            commands.append((int(time_text), command_line))
+        clock = host_runtime.VirtualClock(args.until)
+        host_stdin = host_runtime.ScriptedStdin(commands)
+    host_runtime.setup(clock, host_stdin)
+    import pylib_async
+    pylib_async.set_clock(clock)
+    wall_start_time = time.monotonic()
+    try:
+        runpy.run_path(args.program, run_name="__main__")
+    except host_runtime.TimeLimitReached as ex:
+        print("\ntime limit reached:", ex.value, "ms")
+    except host_runtime.NoMoreEvents as ex:
+        print("\nno more events at:", ex.value, "ms")
+    wall_time_ms = int((time.monotonic() - wall_start_time) * 1000)
+    print("hub time =", clock.time_ms(), "ms, wall time =", wall_time_ms, "ms")
+
+if __name__ == "__main__":
+    main()
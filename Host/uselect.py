@@ -0,0 +1,23 @@
+#******************************************************************************
+# Stand-in for the MicroPython module uselect on a PC.                        *
+#******************************************************************************
+from host_runtime import POLLIN, poll_streams
+
+class poll:
+
+    def __init__(self):
+        self.streams = []
+
+    def register(self, stream, eventmask=POLLIN):
+        if stream not in self.streams:
+            self.streams.append(stream)
+
+    def unregister(self, stream):
+        if stream in self.streams:
+            self.streams.remove(stream)
+
+    def poll(self, timeout=-1):
+        return poll_streams(self.streams, timeout)
+
+    def ipoll(self, timeout=-1):
+        return iter(self.poll(timeout))
@@ -0,0 +1,10 @@
+#******************************************************************************
+# Stand-in for the MicroPython module usys on a PC.                           *
+#******************************************************************************
+import sys
+import host_runtime
+
+stdin = host_runtime.stdin()
+stdout = sys.stdout
+stderr = sys.stderr
+argv = sys.argv
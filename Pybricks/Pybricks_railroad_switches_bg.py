@@ -3,159 +3,114 @@
 #******************************************************************************
 from pybricks.hubs import ThisHub
 from pybricks.parameters import Port
-from pylib_async import EventLoop, WaitForRelativeTime
-from pylib_bg_logger import print_bg_log_messages_and_clean
-from pylib_console import ConsoleHandler, print_prompt
-from pylib_motor import calibrate_motor_task, decalibrate_motor_task, get_motor
+from pylib_async import PRIORITY_COUNT, PRIORITY_HIGH, PRIORITY_LOW, EventLoop
+from pylib_bg_logger import disable_bg_log_streaming, drain_bg_log_task, enable_bg_log_streaming
+from pylib_console import CommandRegistry, ConsoleHandler
+from pylib_motor import MOTOR_TASK_GROUP, calibrate_motor_task, decalibrate_motor_task, get_motor, motor_reads
 from pylib_railroad_switch import Position, print_position, switch_task
-from pylib_telemetry import enable_telemetry, disable_telemetry
+from pylib_telemetry import enable_telemetry, disable_telemetry, stats_telemetry_task
 
 s_event_loop = None
 s_running = True
-s_command_tokens = None
-s_motor1 = None
-s_motor2 = None
-s_motor3 = None
-s_motor4 = None
+s_commands = None
+# Connected motors: argument text [1...4] -> (motor name, motor).
+s_motors = {}
 
-# Print available commands.
-def print_commands():
-    print("X | EXIT .................. terminates the program")
-    print("? | HELP .................. prints available commands")
-    print("A | SWITCH_TO_A <motor> ... switch motor [1...4] to position A")
-    print("B | SWITCH_TO_B <motor> ... switch motor [1...4] to position A")
-    print("C | CALIBRATE <motor> ..... calibrates the motor [1...4]")
-    print("D | DECALIBRATE <motor> ... decalibrates the motor [1...4]")
-    print("L | BACKGROUND_LOG ........ prints the background log")
-    print("T | TELEMETRY_ENABLE ...... enables telemetry printing")
-    print("U | TELEMETRY_DISABLE ..... disables telemetry printing")
+MOTOR_PORTS = (("1", Port.A), ("2", Port.B), ("3", Port.C), ("4", Port.D))
 
 def print_switch_positions():
-    global s_motor1, s_motor2, s_motor3, s_motor4
-    print_position(s_motor1, "motor 1")
-    print_position(s_motor2, "motor 2")
-    print_position(s_motor3, "motor 3")
-    print_position(s_motor4, "motor 4")
+    for motor_key, port in MOTOR_PORTS:
+        motor_entry = s_motors.get(motor_key)
+        print_position(None if motor_entry is None else motor_entry[1], "motor " + motor_key)
 
-# Handle the command line.
-def handle(command_line):
-    global s_running, s_command_tokens
-    s_command_tokens = command_line.split()
-    command = "".join(s_command_tokens[0:1]).upper()
-    if command == "X" or command == "EXIT":
-        s_running = False
-    elif command == "?" or command == "HELP":
-        print_commands()
-        print_switch_positions()
-    elif command == "A" or command == "SWITCH_TO_A":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "B" or command == "SWITCH_TO_B":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "C" or command == "CALIBRATE":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "D" or command == "DECALIBRATE":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "L" or command == "BACKGROUND_LOG":
-        print_bg_log_messages_and_clean()
-    elif command == "T" or command == "TELEMETRY_ENABLE":
-        enable_telemetry()
-    elif command == "U" or command == "TELEMETRY_DISABLE":
-        disable_telemetry()
-    s_command_tokens = None
-    # Show the prompt when True.
-    return s_running
+def exit_command():
+    global s_running
+    s_running = False
+    # Stop the motor tasks and the statistics task immediately.
+    s_event_loop.cancel_all()
+    return False
+
+def help_command():
+    s_commands.print_help()
+    print_switch_positions()
+    for priority in range(PRIORITY_COUNT):
+        # (dispatch count, average latency, max latency)
+        print("priority", priority, "dispatch latency =", s_event_loop.dispatch_latency(priority))
+    print("motor reads =", motor_reads())
+
+def statistics_command():
+    if s_event_loop.stats_enabled:
+        s_event_loop.print_stats()
+    else:
+        print("statistics enabled")
+        s_event_loop.enable_stats()
+        s_event_loop.register_task(stats_telemetry_task(s_event_loop, 5000), "stats_telemetry", priority=PRIORITY_LOW)
+
+# Task commands: the motor tasks are running in background, a running task of
+# the motor is not interrupted.
+def switch_to_a_command(motor_entry):
+    motor_name, motor = motor_entry
+    print("SWITCH_TO_A", motor_name, "...")
+    return switch_task(motor, motor_name, Position.A)
+
+def switch_to_b_command(motor_entry):
+    motor_name, motor = motor_entry
+    print("SWITCH_TO_B", motor_name, "...")
+    return switch_task(motor, motor_name, Position.B)
+
+def calibrate_command(motor_entry):
+    motor_name, motor = motor_entry
+    print("CALIBRATE", motor_name, "...")
+    return calibrate_motor_task(motor, motor_name)
+
+def decalibrate_command(motor_entry):
+    motor_name, motor = motor_entry
+    print("DECALIBRATE", motor_name, "...")
+    return decalibrate_motor_task(motor, motor_name)
+
+# Task command: the log is printed in chunks while the motor tasks are running.
+def drain_log_command():
+    return drain_bg_log_task(report_progress=True)
+
+def create_commands():
+    commands = CommandRegistry(s_event_loop)
+    motor_arg = (("motor", s_motors),)
+    commands.add("X", "EXIT", exit_command, help_text="terminates the program")
+    commands.add("?", "HELP", help_command, help_text="prints available commands")
+    commands.add("A", "SWITCH_TO_A", switch_to_a_command, motor_arg, "switch motor [1...4] to position A",
+                 task_name="motor_task_{0}", priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=10000)
+    commands.add("B", "SWITCH_TO_B", switch_to_b_command, motor_arg, "switch motor [1...4] to position B",
+                 task_name="motor_task_{0}", priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=10000)
+    commands.add("C", "CALIBRATE", calibrate_command, motor_arg, "calibrates the motor [1...4]",
+                 task_name="motor_task_{0}", priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=30000)
+    commands.add("D", "DECALIBRATE", decalibrate_command, motor_arg, "decalibrates the motor [1...4]",
+                 task_name="motor_task_{0}", priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=30000)
+    commands.add("L", "BACKGROUND_LOG", drain_log_command, help_text="prints the background log",
+                 task_name="drain_log", priority=PRIORITY_LOW)
+    commands.add("S", "STATISTICS", statistics_command, help_text="enables and prints loop statistics")
+    commands.add("T", "TELEMETRY_ENABLE", enable_telemetry, help_text="enables telemetry printing")
+    commands.add("U", "TELEMETRY_DISABLE", disable_telemetry, help_text="disables telemetry printing")
+    commands.add("V", "LOG_STREAM_ENABLE", enable_bg_log_streaming, help_text="sends log records to the PC at once")
+    commands.add("W", "LOG_STREAM_DISABLE", disable_bg_log_streaming, help_text="buffers the log records")
+    return commands
 
 # Console task.
 def console():
-    global s_event_loop, s_running, s_command_tokens, s_motor1, s_motor2, s_motor3, s_motor4
+    global s_commands
     print("console started")
-    s_motor1 = get_motor(Port.A, "motor 1")
-    s_motor2 = get_motor(Port.B, "motor 2")
-    s_motor3 = get_motor(Port.C, "motor 3")
-    s_motor4 = get_motor(Port.D, "motor 4")
-    print_commands()
+    for motor_key, port in MOTOR_PORTS:
+        motor = get_motor(port, "motor " + motor_key)
+        if motor:
+            s_motors[motor_key] = ("motor_" + motor_key, motor)
+    s_commands = create_commands()
+    s_commands.print_help()
     print_switch_positions()
-    console_handler = ConsoleHandler(handle)
+    console_handler = ConsoleHandler(s_commands.handle)
+    console_line = console_handler.wait_line()
     while s_running:
-        console_handler.poll()
-        if s_command_tokens:
-            # Command processing shall be done here, because yield must be
-            # called here and not in a sub-function.
-            command = "".join(s_command_tokens[0:1]).upper()
-            arg1 = "".join(s_command_tokens[1:2])
-            if command == "A" or command == "SWITCH_TO_A":
-                if arg1 == "1":
-                    motor = s_motor1
-                elif arg1 == "2":
-                    motor = s_motor2
-                elif arg1 == "3":
-                    motor = s_motor3
-                elif arg1 == "4":
-                    motor = s_motor4
-                else:
-                    motor = None
-                if motor:
-                    # Switch to position A.
-                    print("SWITCH_TO_A", arg1, "...")
-                    s_event_loop.register_task(switch_task(motor, "motor_" + arg1, Position.A), "switch_task_" + arg1)
-            elif command == "B" or command == "SWITCH_TO_B":
-                if arg1 == "1":
-                    motor = s_motor1
-                elif arg1 == "2":
-                    motor = s_motor2
-                elif arg1 == "3":
-                    motor = s_motor3
-                elif arg1 == "4":
-                    motor = s_motor4
-                else:
-                    motor = None
-                if motor:
-                    # Switch to position B.
-                    print("SWITCH_TO_B", arg1, "...")
-                    s_event_loop.register_task(switch_task(motor, "motor_" + arg1, Position.B), "switch_task_" + arg1)
-            elif command == "C" or command == "CALIBRATE":
-                if arg1 == "1":
-                    motor = s_motor1
-                elif arg1 == "2":
-                    motor = s_motor2
-                elif arg1 == "3":
-                    motor = s_motor3
-                elif arg1 == "4":
-                    motor = s_motor4
-                else:
-                    motor = None
-                if motor:
-                    # Calibrate the motor.
-                    print("CALIBRATE", arg1, "...")
-                    s_event_loop.register_task(calibrate_motor_task(motor, "motor_" + arg1), "motor_task_" + arg1)
-            elif command == "D" or command == "DECALIBRATE":
-                if arg1 == "1":
-                    motor = s_motor1
-                elif arg1 == "2":
-                    motor = s_motor2
-                elif arg1 == "3":
-                    motor = s_motor3
-                elif arg1 == "4":
-                    motor = s_motor4
-                else:
-                    motor = None
-                if motor:
-                    # Decalibrate the motor.
-                    print("DECALIBRATE", arg1, "...")
-                    s_event_loop.register_task(decalibrate_motor_task(motor, "motor_" + arg1), "motor_task_" + arg1)
-            s_command_tokens = None
-            print_prompt()
-        else:
-            # This is the poll cycle for the console.
-            yield WaitForRelativeTime(0.1)
+        # The console task is woken when a command line is received.
+        command_line = yield console_line
+        console_handler.process_line(command_line)
     print("console stopped")
     return None
 
@@ -163,6 +118,6 @@ hub = ThisHub()
 hub_name = hub.system.name()
 print("hub_name =", hub_name)
 s_event_loop = EventLoop()
-s_event_loop.register_task(console(), "console")
-s_event_loop.run(poll_time=0.01)
+s_event_loop.register_task(console(), "console", priority=PRIORITY_LOW)
+s_event_loop.run_tickless_ms(poll_time_ms=10)
 print("processing finished")
\ No newline at end of file
@@ -1,7 +1,7 @@
 #******************************************************************************
 # Tests the pylib_async and pylib_console.                                    *
 #******************************************************************************
-from pylib_async import EventLoop, WaitFor, WaitForRelativeTime
+from pylib_async import PRIORITY_LOW, Event, EventLoop, WaitForAny, WaitForPeriodMs
 from pylib_console import ConsoleHandler
 
 ACCU_STATE_MIN = 0
@@ -17,6 +17,7 @@ s_charge_state2 = None
 s_charge_state3 = None
 s_charge_state4 = None
 s_running = None
+s_stop_event = Event()
 
 # Task for accu 1.
 def accu1():
@@ -24,12 +25,14 @@ def accu1():
     print("accu1 started")
     s_accu_state1 = ACCU_STATE_MIN
     s_charge_state1 = CHARGE_STATE_DISCHARGE
-    while s_accu_state1 != None:
+    # the task is woken by the period or immediately by the stop event
+    period = WaitForAny(WaitForPeriodMs(1000), s_stop_event.wait())
+    while not s_stop_event.is_set:
         if s_charge_state1 == CHARGE_STATE_CHARGE and s_accu_state1 < ACCU_STATE_MAX:
             s_accu_state1 += 1
         elif s_charge_state1 == CHARGE_STATE_DISCHARGE and s_accu_state1 > ACCU_STATE_MIN:
             s_accu_state1 -= 1
-        yield WaitForRelativeTime(1)
+        yield period
     print("accu1 stopped")
     return None
 
@@ -39,12 +42,14 @@ def accu2():
     print("accu2 started")
     s_accu_state2 = ACCU_STATE_MIN
     s_charge_state2 = CHARGE_STATE_DISCHARGE
-    while s_accu_state2 != None:
+    # the task is woken by the period or immediately by the stop event
+    period = WaitForAny(WaitForPeriodMs(1000), s_stop_event.wait())
+    while not s_stop_event.is_set:
         if s_charge_state2 == CHARGE_STATE_CHARGE and s_accu_state2 < ACCU_STATE_MAX:
             s_accu_state2 += 1
         elif s_charge_state2 == CHARGE_STATE_DISCHARGE and s_accu_state2 > ACCU_STATE_MIN:
             s_accu_state2 -= 1
-        yield WaitForRelativeTime(1)
+        yield period
     print("accu2 stopped")
     return None
 
@@ -54,12 +59,14 @@ def accu3():
     print("accu3 started")
     s_accu_state3 = ACCU_STATE_MIN
     s_charge_state3 = CHARGE_STATE_DISCHARGE
-    while s_accu_state3 != None:
+    # the task is woken by the period or immediately by the stop event
+    period = WaitForAny(WaitForPeriodMs(1000), s_stop_event.wait())
+    while not s_stop_event.is_set:
         if s_charge_state3 == CHARGE_STATE_CHARGE and s_accu_state3 < ACCU_STATE_MAX:
             s_accu_state3 += 1
         elif s_charge_state3 == CHARGE_STATE_DISCHARGE and s_accu_state3 > ACCU_STATE_MIN:
             s_accu_state3 -= 1
-        yield WaitForRelativeTime(1)
+        yield period
     print("accu3 stopped")
     return None
 
@@ -69,12 +76,14 @@ def accu4():
     print("accu4 started")
     s_accu_state4 = ACCU_STATE_MIN
     s_charge_state4 = CHARGE_STATE_DISCHARGE
-    while s_accu_state4 != None:
+    # the task is woken by the period or immediately by the stop event
+    period = WaitForAny(WaitForPeriodMs(1000), s_stop_event.wait())
+    while not s_stop_event.is_set:
         if s_charge_state4 == CHARGE_STATE_CHARGE and s_accu_state4 < ACCU_STATE_MAX:
             s_accu_state4 += 1
         elif s_charge_state4 == CHARGE_STATE_DISCHARGE and s_accu_state4 > ACCU_STATE_MIN:
             s_accu_state4 -= 1
-        yield WaitForRelativeTime(1)
+        yield period
     print("accu4 stopped")
     return None
 
@@ -110,6 +119,7 @@ def handle(command_line):
         print("C | CHARGE <accu> ...... charge an accu 1-4")
         print("D | DISCHARGE <accu> ... discharge an accu 1-4")
         print_accu_states()
+        print("missed periods =", event_loop.overruns)
     elif command == "C" and arg1 == "1":
         print("charge accu1...")
         s_charge_state1 = CHARGE_STATE_CHARGE
@@ -139,18 +149,17 @@ def handle(command_line):
 
 # Console task.
 def console():
-    global s_running, s_accu_state1, s_accu_state2, s_accu_state3, s_accu_state4
+    global s_running
     print("console started")
     print_accu_states()
     console_handler = ConsoleHandler(handle)
+    console_line = console_handler.wait_line()
     s_running = True
     while s_running:
-        console_handler.poll()
-        yield WaitForRelativeTime(0.1)
-    s_accu_state1 = None
-    s_accu_state2 = None
-    s_accu_state3 = None
-    s_accu_state4 = None
+        # The console task is woken when a command line is received.
+        command_line = yield console_line
+        console_handler.process_line(command_line)
+    s_stop_event.set()
     print("console stopped")
     return None
 
@@ -159,6 +168,6 @@ event_loop.register_task(accu1(), "accu1")
 event_loop.register_task(accu2(), "accu2")
 event_loop.register_task(accu3(), "accu3")
 event_loop.register_task(accu4(), "accu4")
-event_loop.register_task(console(), "console")
-event_loop.run(poll_time=0.01)
+event_loop.register_task(console(), "console", priority=PRIORITY_LOW)
+event_loop.run_tickless_ms(poll_time_ms=10)
 print("processing finished")
\ No newline at end of file
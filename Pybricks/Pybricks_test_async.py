@@ -38,9 +38,85 @@ def foo3():
         print("foo3c, exception =", ex)
     print("task foo3 finished")
 
+# Sub-generator: runs inside the slot of the calling task.
+def sub_foo(name, wait_time):
+    event_time = yield pylib_async.WaitForRelativeTime(wait_time)
+    print(name, "event_time =", event_time)
+    if wait_time > 2:
+        raise pylib_async.TimeoutException(wait_time)
+    return wait_time * 10
+
+# foo4a --> foo4b --> foo4c --> foo4d
+def foo4():
+    print("foo4a")
+    # yield a generator: the task receives its return value
+    return_value = yield sub_foo("foo4b,", 1)
+    print("foo4b, return_value =", return_value)
+    # yield from works as well
+    return_value = yield from sub_foo("foo4c,", 2)
+    print("foo4c, return_value =", return_value)
+    try:
+        yield sub_foo("foo4d,", 3)
+    except pylib_async.TimeoutException as ex:
+        # the exception of the sub-generator is received directly
+        print("foo4d, exception =", ex)
+    print("task foo4 finished")
+    return 789
+
+# Polled condition: true when the flag is set.
+class WaitForFlag(pylib_async.WaitFor):
+
+    def __init__(self, flags, name):
+        super().__init__()
+        self.flags = flags
+        self.name = name
+
+    def test_event(self, event_loop):
+        return (self.name in self.flags, self.name)
+
+s_flags = set()
+
+# foo5a --> foo5b --> foo5c --> foo5d
+def foo5():
+    print("foo5a")
+    # task foo1 is not finished within 2 seconds: the timer fires
+    condition = pylib_async.WaitForAny(pylib_async.WaitForTaskCompleted("foo1"), pylib_async.WaitForRelativeTime(2))
+    index = yield condition
+    print("foo5b, index =", index, "value =", condition.value)
+    values = yield pylib_async.WaitForAll(pylib_async.WaitForTaskCompleted("foo1"), pylib_async.WaitForTaskCompleted("foo4"))
+    print("foo5c, values =", values)
+    # a polled composite: its non-polled children are subscribed as well
+    condition = pylib_async.WaitForAny(WaitForFlag(s_flags, "never"), pylib_async.WaitForTaskCompleted("foo6"))
+    index = yield condition
+    print("foo5d, index =", index, "value =", condition.value)
+    print("task foo5 finished")
+
+# foo6a --> foo6b --> foo6c
+def foo6():
+    print("foo6a")
+    event_time = yield pylib_async.WaitForRelativeTime(8)
+    print("foo6b, event_time =", event_time)
+    # task foo7 has finished long ago: its result is kept for this waiter
+    return_value = yield pylib_async.WaitForTaskCompleted("foo7")
+    print("foo6c, return_value =", return_value)
+    print("task foo6 finished")
+    return 1011
+
+# foo7a --> foo7b
+def foo7():
+    print("foo7a")
+    event_time = yield pylib_async.WaitForRelativeTime(1)
+    print("foo7b, event_time =", event_time)
+    print("task foo7 finished")
+    return 1213
+
 event_loop = pylib_async.EventLoop()
 event_loop.register_task(foo1(), "foo1")
 event_loop.register_task(foo2(), "foo2")
 event_loop.register_task(foo3(), "foo3")
-event_loop.run(poll_time=0.1)
+event_loop.register_task(foo4(), "foo4")
+event_loop.register_task(foo5(), "foo5")
+event_loop.register_task(foo6(), "foo6")
+event_loop.register_task(foo7(), "foo7")
+event_loop.run_tickless(poll_time=0.1)
 print("processing finished")
\ No newline at end of file
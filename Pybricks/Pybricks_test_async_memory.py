@@ -0,0 +1,54 @@
+#******************************************************************************
+# Tests that idle loop passes of the pylib_async EventLoop allocate nothing.  *
+#******************************************************************************
+import gc
+from pylib_async import NOT_REACHED, EventLoop, WaitFor, WaitForRelativeTimeMs
+from pylib_console import ConsoleHandler
+
+IDLE_TICKS = 10000
+
+# Condition that is never reached, it is tested on each loop pass.
+class WaitForNever(WaitFor):
+
+    def test_event(self, event_loop):
+        return NOT_REACHED
+
+# Task that sleeps longer than the test is running.
+def sleeping_task():
+    yield WaitForRelativeTimeMs(3600000)
+    return None
+
+# Task with a polled condition.
+def polling_task():
+    yield WaitForNever()
+    return None
+
+# Task that waits for a command line, stdin is checked on each loop pass.
+def console_task():
+    console_handler = ConsoleHandler()
+    yield console_handler.wait_line()
+    return None
+
+event_loop = EventLoop()
+for i in range(20):
+    event_loop.register_task(sleeping_task(), "sleeping_task_" + str(i))
+for i in range(5):
+    event_loop.register_task(polling_task(), "polling_task_" + str(i))
+event_loop.register_task(console_task(), "console_task")
+# In the first loop pass the tasks start waiting for their conditions.
+event_loop.process_next_events()
+gc.collect()
+gc.disable()
+mem_free_before = gc.mem_free()
+tick = 0
+while tick < IDLE_TICKS:
+    event_loop.process_next_events()
+    tick += 1
+mem_free_after = gc.mem_free()
+gc.enable()
+print("mem_free before =", mem_free_before)
+print("mem_free after  =", mem_free_after)
+if mem_free_after == mem_free_before:
+    print("test passed")
+else:
+    print("test failed")
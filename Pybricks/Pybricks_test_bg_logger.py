@@ -1,9 +1,9 @@
 #******************************************************************************
 # Tests the pylib_bg_logger.                                                  *
 #******************************************************************************
-from pylib_async import EventLoop, WaitFor, WaitForRelativeTime
+from pylib_async import PRIORITY_LOW, EventLoop, WaitFor, WaitForPeriodMs
 from pylib_console import ConsoleHandler
-from pylib_bg_logger import bg_log, print_bg_log_messages_and_clean
+from pylib_bg_logger import bg_log, configure_bg_logger, drain_bg_log_task, print_bg_log_messages_and_clean
 
 s_running = True
 
@@ -12,10 +12,11 @@ def task1():
     global s_running
     print("task1 started")
     counter = 0
+    period = WaitForPeriodMs(1000)
     while s_running:
-        bg_log(f"task1: {counter}")
+        bg_log("task1: {}", counter)
         counter += 1
-        yield WaitForRelativeTime(1)
+        yield period
     print("task1 stopped")
     return None
 
@@ -24,10 +25,11 @@ def task2():
     global s_running
     print("task2 started")
     counter = 0
+    period = WaitForPeriodMs(2000)
     while s_running:
-        bg_log(f"task2: {counter}")
+        bg_log("task2: {}", counter)
         counter += 1
-        yield WaitForRelativeTime(2)
+        yield period
     print("task2 stopped")
     return None
 
@@ -42,9 +44,13 @@ def handle(command_line):
         print("X | EXIT .... terminates the program")
         print("? | HELP .... prints available commands")
         print("P | PRINT ... print the background log and clean")
+        print("D | DRAIN ... print the background log in chunks of 2 messages")
     elif command == "P" or command == "PRINT":
         print("log messages:")
         print_bg_log_messages_and_clean()
+    elif command == "D" or command == "DRAIN":
+        if not event_loop.task_exists("drain_log"):
+            event_loop.register_task(drain_bg_log_task(max_entries=2, report_progress=True), "drain_log", priority=PRIORITY_LOW)
     # Show the prompt when True.
     return s_running
 
@@ -53,15 +59,19 @@ def console():
     global s_running
     print("console started")
     console_handler = ConsoleHandler(handle)
+    console_line = console_handler.wait_line()
     while s_running:
-        console_handler.poll()
-        yield WaitForRelativeTime(0.1)
+        # The console task is woken when a command line is received.
+        command_line = yield console_line
+        console_handler.process_line(command_line)
     print("console stopped")
     return None
 
+# The log keeps the last 8 messages, older messages are overwritten.
+configure_bg_logger(capacity=8)
 event_loop = EventLoop()
 event_loop.register_task(task1(), "task1")
 event_loop.register_task(task2(), "task2")
-event_loop.register_task(console(), "console")
-event_loop.run(poll_time=0.01)
+event_loop.register_task(console(), "console", priority=PRIORITY_LOW)
+event_loop.run_tickless_ms(poll_time_ms=10)
 print("processing finished")
\ No newline at end of file
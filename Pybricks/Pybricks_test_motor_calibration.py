@@ -3,105 +3,102 @@
 #******************************************************************************
 from pybricks.hubs import ThisHub
 from pybricks.parameters import Port
-from pylib_async import EventLoop, WaitForRelativeTime, WaitForTaskCompleted
-from pylib_bg_logger import print_bg_log_messages_and_clean
-from pylib_console import ConsoleHandler, print_prompt
-from pylib_motor import calibrate_motor_task, decalibrate_motor_task, get_motor
+from pylib_async import PRIORITY_HIGH, PRIORITY_LOW, CancelledException, EventLoop, Queue, WaitForTaskCompletedMs
+from pylib_bg_logger import drain_bg_log_task
+from pylib_console import CommandRegistry, ConsoleHandler, complete_command, defer_command
+from pylib_motor import MOTOR_TASK_GROUP, calibrate_motor_task, decalibrate_motor_task, get_motor
 from pylib_telemetry import enable_telemetry, disable_telemetry
 
 s_event_loop = None
 s_running = True
-s_command_tokens = None
+s_commands = None
+s_command_queue = Queue()
+# Connected motors: argument text [1...4] -> (motor name, motor).
+s_motors = {}
 
-# Print available commands.
-def print_commands():
-    print("X | EXIT .................. terminates the program")
-    print("? | HELP .................. prints available commands")
-    print("C | CALIBRATE <motor> ..... calibrates the motor [1...4]")
-    print("D | DECALIBRATE <motor> ... decalibrates the motor [1...4]")
-    print("T | TELEMETRY_ENABLE ...... enables telemetry printing")
-    print("U | TELEMETRY_DISABLE ..... disables telemetry printing")
+MOTOR_PORTS = (("1", Port.A), ("2", Port.B), ("3", Port.C), ("4", Port.D))
 
-# Handle the command line.
-def handle(command_line):
-    global s_running, s_command_tokens
-    s_command_tokens = command_line.split()
-    command = "".join(s_command_tokens[0:1]).upper()
-    if command == "X" or command == "EXIT":
-        s_running = False
-    elif command == "?" or command == "HELP":
-        print_commands()
-    elif command == "C" or command == "CALIBRATE":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "D" or command == "DECALIBRATE":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "T" or command == "TELEMETRY_ENABLE":
-        enable_telemetry()
-    elif command == "U" or command == "TELEMETRY_DISABLE":
-        disable_telemetry()
-    s_command_tokens = None
-    # Show the prompt when True.
-    return s_running
+def exit_command():
+    global s_running
+    s_running = False
+    # Stop the motor tasks immediately and the command task, pending
+    # commands are dropped.
+    s_event_loop.cancel_group(MOTOR_TASK_GROUP)
+    s_command_queue.clear()
+    s_command_queue.put(None)
+    return False
+
+# Runs the motor task and waits until it is completed, runs as sub-generator
+# of the command task.
+def run_motor_task(command_name, motor_name, motor_task, task_name, timeout_ms):
+    print(command_name, motor_name, "...")
+    s_event_loop.register_task(motor_task, task_name, priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=timeout_ms)
+    yield WaitForTaskCompletedMs(task_name, timeout_ms)
+    return None
+
+# Processing of the motor commands is done in the command task. The command
+# is deferred, the prompt or the acknowledgement is sent when the task is
+# finished.
+def calibrate_command(motor_entry):
+    motor_name, motor = motor_entry
+    s_command_queue.put((run_motor_task("CALIBRATE", motor_name, calibrate_motor_task(motor, motor_name), "motor_task", 30000), defer_command()))
+    return False
+
+def decalibrate_command(motor_entry):
+    motor_name, motor = motor_entry
+    s_command_queue.put((run_motor_task("DECALIBRATE", motor_name, decalibrate_motor_task(motor, motor_name), "motor_task", 30000), defer_command()))
+    return False
+
+def create_commands():
+    commands = CommandRegistry(s_event_loop)
+    motor_arg = (("motor", s_motors),)
+    commands.add("X", "EXIT", exit_command, help_text="terminates the program")
+    commands.add("?", "HELP", commands.print_help, help_text="prints available commands")
+    commands.add("C", "CALIBRATE", calibrate_command, motor_arg, "calibrates the motor [1...4]")
+    commands.add("D", "DECALIBRATE", decalibrate_command, motor_arg, "decalibrates the motor [1...4]")
+    commands.add("T", "TELEMETRY_ENABLE", enable_telemetry, help_text="enables telemetry printing")
+    commands.add("U", "TELEMETRY_DISABLE", disable_telemetry, help_text="disables telemetry printing")
+    return commands
+
+# Command task: runs the motor commands from the console one after another,
+# it is woken immediately when the console puts a command.
+def command_task():
+    next_command = s_command_queue.get()
+    while True:
+        command = yield next_command
+        if command is None:
+            break
+        motor_command, sequence_number = command
+        try:
+            # the motor task is awaited inside the command task
+            yield motor_command
+        except CancelledException:
+            # the motor task has been cancelled by EXIT
+            break
+        except Exception as ex:
+            print("command exception =", ex)
+        if not s_running:
+            break
+        yield drain_bg_log_task()
+        complete_command(sequence_number)
+    return None
 
 # Console task.
 def console():
-    global s_event_loop, s_running, s_command_tokens
+    global s_commands
     print("console started")
-    motor1 = get_motor(Port.A, "motor 1")
-    motor2 = get_motor(Port.B, "motor 2")
-    motor3 = get_motor(Port.C, "motor 3")
-    motor4 = get_motor(Port.D, "motor 4")
-    print_commands()
-    console_handler = ConsoleHandler(handle)
+    for motor_key, port in MOTOR_PORTS:
+        motor = get_motor(port, "motor " + motor_key)
+        if motor:
+            s_motors[motor_key] = ("motor_" + motor_key, motor)
+    s_commands = create_commands()
+    s_commands.print_help()
+    console_handler = ConsoleHandler(s_commands.handle)
+    console_line = console_handler.wait_line()
     while s_running:
-        console_handler.poll()
-        if s_command_tokens:
-            # Command processing shall be done here, because yield must be
-            # called here and not in a sub-function.
-            command = "".join(s_command_tokens[0:1]).upper()
-            arg1 = "".join(s_command_tokens[1:2])
-            if command == "C" or command == "CALIBRATE":
-                if arg1 == "1":
-                    motor = motor1
-                elif arg1 == "2":
-                    motor = motor2
-                elif arg1 == "3":
-                    motor = motor3
-                elif arg1 == "4":
-                    motor = motor4
-                else:
-                    motor = None
-                if motor:
-                    # Calibrate the motor and wait until completed.
-                    print("CALIBRATE", arg1, "...")
-                    s_event_loop.register_task(calibrate_motor_task(motor, "motor_" + arg1), "motor_task")
-                    yield WaitForTaskCompleted("motor_task", 30)
-            elif command == "D" or command == "DECALIBRATE":
-                if arg1 == "1":
-                    motor = motor1
-                elif arg1 == "2":
-                    motor = motor2
-                elif arg1 == "3":
-                    motor = motor3
-                elif arg1 == "4":
-                    motor = motor4
-                else:
-                    motor = None
-                if motor:
-                    # Decalibrate the motor and wait until completed.
-                    print("DECALIBRATE", arg1, "...")
-                    s_event_loop.register_task(decalibrate_motor_task(motor, "motor_" + arg1), "motor_task")
-                    yield WaitForTaskCompleted("motor_task", 30)
-            s_command_tokens = None
-            print_bg_log_messages_and_clean()
-            print_prompt()
-        else:
-            # This is the poll cycle for the console.
-            yield WaitForRelativeTime(0.1)
+        # The console task is woken when a command line is received.
+        command_line = yield console_line
+        console_handler.process_line(command_line)
     print("console stopped")
     return None
 
@@ -109,6 +106,7 @@ hub = ThisHub()
 hub_name = hub.system.name()
 print("hub_name =", hub_name)
 s_event_loop = EventLoop()
-s_event_loop.register_task(console(), "console")
-s_event_loop.run(poll_time=0.01)
+s_event_loop.register_task(console(), "console", priority=PRIORITY_LOW)
+s_event_loop.register_task(command_task(), "command_task", priority=PRIORITY_LOW)
+s_event_loop.run_tickless_ms(poll_time_ms=10)
 print("processing finished")
\ No newline at end of file
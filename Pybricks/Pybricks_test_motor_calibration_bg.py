@@ -3,105 +3,76 @@
 #******************************************************************************
 from pybricks.hubs import ThisHub
 from pybricks.parameters import Port
-from pylib_async import EventLoop, WaitForRelativeTime
-from pylib_bg_logger import print_bg_log_messages_and_clean
-from pylib_console import ConsoleHandler, print_prompt
-from pylib_motor import calibrate_motor_task, decalibrate_motor_task, get_motor
+from pylib_async import PRIORITY_HIGH, PRIORITY_LOW, EventLoop
+from pylib_bg_logger import disable_bg_log_streaming, drain_bg_log_task, enable_bg_log_streaming
+from pylib_console import CommandRegistry, ConsoleHandler
+from pylib_motor import MOTOR_TASK_GROUP, calibrate_motor_task, decalibrate_motor_task, get_motor
 from pylib_telemetry import enable_telemetry, disable_telemetry
 
 s_event_loop = None
 s_running = True
-s_command_tokens = None
+s_commands = None
+# Connected motors: argument text [1...4] -> (motor name, motor).
+s_motors = {}
 
-# Print available commands.
-def print_commands():
-    print("X | EXIT .................. terminates the program")
-    print("? | HELP .................. prints available commands")
-    print("C | CALIBRATE <motor> ..... calibrates the motor [1...4]")
-    print("D | DECALIBRATE <motor> ... decalibrates the motor [1...4]")
-    print("L | BACKGROUND_LOG ........ prints the background log")
-    print("T | TELEMETRY_ENABLE ...... enables telemetry printing")
-    print("U | TELEMETRY_DISABLE ..... disables telemetry printing")
+MOTOR_PORTS = (("1", Port.A), ("2", Port.B), ("3", Port.C), ("4", Port.D))
 
-# Handle the command line.
-def handle(command_line):
-    global s_running, s_command_tokens
-    s_command_tokens = command_line.split()
-    command = "".join(s_command_tokens[0:1]).upper()
-    if command == "X" or command == "EXIT":
-        s_running = False
-    elif command == "?" or command == "HELP":
-        print_commands()
-    elif command == "C" or command == "CALIBRATE":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "D" or command == "DECALIBRATE":
-        # Processing of the command is done in the console task.
-        # Don't show the prompt, this shall be done when the task is finished.
-        return False
-    elif command == "L" or command == "BACKGROUND_LOG":
-        print_bg_log_messages_and_clean()
-    elif command == "T" or command == "TELEMETRY_ENABLE":
-        enable_telemetry()
-    elif command == "U" or command == "TELEMETRY_DISABLE":
-        disable_telemetry()
-    s_command_tokens = None
-    # Show the prompt when True.
-    return s_running
+def exit_command():
+    global s_running
+    s_running = False
+    # Stop the motor tasks immediately.
+    s_event_loop.cancel_group(MOTOR_TASK_GROUP)
+    return False
+
+# Task commands: the motor tasks are running in background, a running task of
+# the motor is not interrupted.
+def calibrate_command(motor_entry):
+    motor_name, motor = motor_entry
+    print("CALIBRATE", motor_name, "...")
+    return calibrate_motor_task(motor, motor_name)
+
+def decalibrate_command(motor_entry):
+    motor_name, motor = motor_entry
+    print("DECALIBRATE", motor_name, "...")
+    return decalibrate_motor_task(motor, motor_name)
+
+# Task command: the log is printed in chunks while the motor tasks are running.
+def drain_log_command():
+    return drain_bg_log_task(report_progress=True)
+
+def create_commands():
+    commands = CommandRegistry(s_event_loop)
+    motor_arg = (("motor", s_motors),)
+    commands.add("X", "EXIT", exit_command, help_text="terminates the program")
+    commands.add("?", "HELP", commands.print_help, help_text="prints available commands")
+    commands.add("C", "CALIBRATE", calibrate_command, motor_arg, "calibrates the motor [1...4]",
+                 task_name="motor_task_{0}", priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=30000)
+    commands.add("D", "DECALIBRATE", decalibrate_command, motor_arg, "decalibrates the motor [1...4]",
+                 task_name="motor_task_{0}", priority=PRIORITY_HIGH, group=MOTOR_TASK_GROUP, timeout_ms=30000)
+    commands.add("L", "BACKGROUND_LOG", drain_log_command, help_text="prints the background log",
+                 task_name="drain_log", priority=PRIORITY_LOW)
+    commands.add("T", "TELEMETRY_ENABLE", enable_telemetry, help_text="enables telemetry printing")
+    commands.add("U", "TELEMETRY_DISABLE", disable_telemetry, help_text="disables telemetry printing")
+    commands.add("V", "LOG_STREAM_ENABLE", enable_bg_log_streaming, help_text="sends log records to the PC at once")
+    commands.add("W", "LOG_STREAM_DISABLE", disable_bg_log_streaming, help_text="buffers the log records")
+    return commands
 
 # Console task.
 def console():
-    global s_event_loop, s_running, s_command_tokens
+    global s_commands
     print("console started")
-    motor1 = get_motor(Port.A, "motor 1")
-    motor2 = get_motor(Port.B, "motor 2")
-    motor3 = get_motor(Port.C, "motor 3")
-    motor4 = get_motor(Port.D, "motor 4")
-    print_commands()
-    console_handler = ConsoleHandler(handle)
+    for motor_key, port in MOTOR_PORTS:
+        motor = get_motor(port, "motor " + motor_key)
+        if motor:
+            s_motors[motor_key] = ("motor_" + motor_key, motor)
+    s_commands = create_commands()
+    s_commands.print_help()
+    console_handler = ConsoleHandler(s_commands.handle)
+    console_line = console_handler.wait_line()
     while s_running:
-        console_handler.poll()
-        if s_command_tokens:
-            # Command processing shall be done here, because yield must be
-            # called here and not in a sub-function.
-            command = "".join(s_command_tokens[0:1]).upper()
-            arg1 = "".join(s_command_tokens[1:2])
-            if command == "C" or command == "CALIBRATE":
-                if arg1 == "1":
-                    motor = motor1
-                elif arg1 == "2":
-                    motor = motor2
-                elif arg1 == "3":
-                    motor = motor3
-                elif arg1 == "4":
-                    motor = motor4
-                else:
-                    motor = None
-                if motor and not s_event_loop.task_exists(task_name):
-                    # Calibrate the motor.
-                    print("CALIBRATE", arg1, "...")
-                    s_event_loop.register_task(calibrate_motor_task(motor, "motor_" + arg1), "motor_task_" + arg1)
-            elif command == "D" or command == "DECALIBRATE":
-                if arg1 == "1":
-                    motor = motor1
-                elif arg1 == "2":
-                    motor = motor2
-                elif arg1 == "3":
-                    motor = motor3
-                elif arg1 == "4":
-                    motor = motor4
-                else:
-                    motor = None
-                if motor and not s_event_loop.task_exists(task_name):
-                    # Decalibrate the motor.
-                    print("DECALIBRATE", arg1, "...")
-                    s_event_loop.register_task(decalibrate_motor_task(motor, "motor_" + arg1), "motor_task_" + arg1)
-            s_command_tokens = None
-            print_prompt()
-        else:
-            # This is the poll cycle for the console.
-            yield WaitForRelativeTime(0.1)
+        # The console task is woken when a command line is received.
+        command_line = yield console_line
+        console_handler.process_line(command_line)
     print("console stopped")
     return None
 
@@ -109,6 +80,6 @@ hub = ThisHub()
 hub_name = hub.system.name()
 print("hub_name =", hub_name)
 s_event_loop = EventLoop()
-s_event_loop.register_task(console(), "console")
-s_event_loop.run(poll_time=0.01)
+s_event_loop.register_task(console(), "console", priority=PRIORITY_LOW)
+s_event_loop.run_tickless_ms(poll_time_ms=10)
 print("processing finished")
\ No newline at end of file
@@ -0,0 +1,39 @@
+#******************************************************************************
+# Tests the pylib_multitask with the motor tasks.                             *
+#******************************************************************************
+from pybricks.parameters import Port
+from pylib_async import WaitForAll, WaitForPeriodMs, WaitForTaskCompletedMs, time_ms
+from pylib_bg_logger import print_bg_log_messages_and_clean
+from pylib_motor import calibrate_motor_task, decalibrate_motor_task, get_motor
+from pylib_multitask import MultitaskEventLoop
+from pylib_railroad_switch import Position, switch_task
+
+# Prints the time every second until the motor tasks are completed.
+def clock_task():
+    period = WaitForPeriodMs(1000)
+    while event_loop.task_exists("decalibrate") or event_loop.task_exists("switch"):
+        yield period
+        print("time =", time_ms())
+    return None
+
+# Runs the motor tasks one after another.
+def motor_task(motor1, motor2):
+    print("decalibrate and switch...")
+    event_loop.register_task(decalibrate_motor_task(motor1, "motor_1"), "decalibrate", timeout_ms=30000)
+    event_loop.register_task(switch_task(motor2, "motor_2", Position.A), "switch", timeout_ms=10000)
+    values = yield WaitForAll(WaitForTaskCompletedMs("decalibrate"), WaitForTaskCompletedMs("switch"))
+    print("decalibrate and switch done, values =", values)
+    print("calibrate...")
+    # the generator runs as sub-generator in the slot of this task
+    yield calibrate_motor_task(motor1, "motor_1")
+    print("calibrate done")
+    print_bg_log_messages_and_clean()
+    return None
+
+motor1 = get_motor(Port.A, "motor 1")
+motor2 = get_motor(Port.B, "motor 2")
+event_loop = MultitaskEventLoop()
+event_loop.register_task(motor_task(motor1, motor2), "motor_task")
+event_loop.register_task(clock_task(), "clock_task")
+event_loop.run_tickless_ms(poll_time_ms=10)
+print("processing finished")
@@ -2,125 +2,1244 @@
 # Event loop and criterieas for asynchronous processing.                      *
 #******************************************************************************
 from pybricks.tools import StopWatch, wait
+from uselect import poll
+from usys import stdin
 
-s_stop_watch = None
+# Clock of the hub. It can be replaced via set_clock(), e.g. by a virtual
+# clock on a PC that fast-forwards to the next wake time.
+class HubClock:
+
+    def __init__(self):
+        self.stop_watch = StopWatch()
+
+    def time_ms(self):
+        return self.stop_watch.time()
+
+    def sleep_ms(self, sleep_time_ms):
+        wait(sleep_time_ms)
+
+s_clock = None
+
+def set_clock(clock):
+    global s_clock
+    s_clock = clock
+
+# The event loop works with integer milliseconds, because on the hub each
+# float is allocated on the heap. The functions with seconds are wrappers.
+def time_sleep_ms(sleep_time_ms):
+    global s_clock
+    if s_clock is None:
+        s_clock = HubClock()
+    s_clock.sleep_ms(sleep_time_ms)
 
 def time_sleep(sleep_time_sec):
-    wait(sleep_time_sec * 1000)
+    time_sleep_ms(int(sleep_time_sec * 1000))
+
+def time_ms():
+    global s_clock
+    if s_clock is None:
+        s_clock = HubClock()
+    return s_clock.time_ms()
 
 def time_time():
-    global s_stop_watch
-    if s_stop_watch is None:
-        s_stop_watch = StopWatch()
-    return s_stop_watch.time() / 1000
+    return time_ms() / 1000
+
+s_loop_pass = 0
+s_loop_pass_used = False
+
+# Number of the current loop pass. Values that are sampled in the same loop
+# pass can be shared by all conditions of the pass (e.g. sensor values).
+def loop_pass():
+    global s_loop_pass_used
+    s_loop_pass_used = True
+    return s_loop_pass
+
+# The number only changes after it has been used, so the passes of an idle
+# loop do not create new int objects.
+def next_loop_pass():
+    global s_loop_pass, s_loop_pass_used
+    if s_loop_pass_used:
+        s_loop_pass += 1
+        s_loop_pass_used = False
+
+# Returns True when the poll object reports received data within the timeout
+# [ms]. ipoll() reuses its result on MicroPython, poll() would allocate a list
+# on each call.
+def poll_ready(input_poll, timeout_ms):
+    for event in input_poll.ipoll(timeout_ms):
+        return True
+    return False
+
+# Name of the running task, e.g. the origin of log messages (None: no task).
+s_current_task_name = None
+
+def current_task_name():
+    return s_current_task_name
 
 class TimeoutException(Exception):
 
     def __init__(self, value):
         self.value = value
 
+# Thrown into a task that is cancelled.
+class CancelledException(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+# Type of the generators, a task that yields a generator runs it as
+# sub-generator.
+def generator_function():
+    yield None
+
+GENERATOR_TYPE = type(generator_function())
+
+# Conditions return these constants to avoid the allocation of a tuple.
+REACHED = (True, None)
+REACHED_IN_TIME = (True, 0)
+NOT_REACHED = (False, None)
+
+# The timers are a min-heap of tasks ordered by wake time and sequence.
+# Each task knows its index in the heap, so it can be removed when woken.
+def timer_before(task1, task2):
+    if task1.wake_time != task2.wake_time:
+        return task1.wake_time < task2.wake_time
+    return task1.timer_sequence < task2.timer_sequence
+
+def heap_sift_up(heap, index):
+    task = heap[index]
+    while index > 0:
+        parent = (index - 1) >> 1
+        parent_task = heap[parent]
+        if not timer_before(task, parent_task):
+            break
+        heap[index] = parent_task
+        parent_task.heap_index = index
+        index = parent
+    heap[index] = task
+    task.heap_index = index
+
+def heap_sift_down(heap, index):
+    task = heap[index]
+    size = len(heap)
+    while True:
+        child = 2 * index + 1
+        if child >= size:
+            break
+        if child + 1 < size and timer_before(heap[child + 1], heap[child]):
+            child += 1
+        child_task = heap[child]
+        if not timer_before(child_task, task):
+            break
+        heap[index] = child_task
+        child_task.heap_index = index
+        index = child
+    heap[index] = task
+    task.heap_index = index
+
+def heap_push(heap, task):
+    heap.append(task)
+    heap_sift_up(heap, len(heap) - 1)
+
+def heap_remove(heap, task):
+    index = task.heap_index
+    task.heap_index = -1
+    last_task = heap.pop()
+    if last_task is not task:
+        heap[index] = last_task
+        heap_sift_down(heap, index)
+        heap_sift_up(heap, last_task.heap_index)
+
+def heap_pop(heap):
+    task = heap[0]
+    heap_remove(heap, task)
+    return task
+
 class WaitFor:
 
+    # Conditions that are polled are tested on every loop pass. Conditions
+    # that are not polled are only tested when their wake time is reached or
+    # when the waiting task is woken by the event loop.
+    polled = True
+
     def __init__(self):
         pass
 
+    # Time [ms] when the condition shall be tested (None: no time known).
+    def wake_time(self):
+        return None
+
+    # Called by the event loop when a task starts waiting for the condition,
+    # before the wake time is requested.
+    def subscribe(self, event_loop, task):
+        pass
+
+    # Called by the event loop when a waiting task is cancelled.
+    def unsubscribe(self, event_loop, task):
+        pass
+
     def test_event(self, event_loop):
         # (condition reached, return value)
-        return (True, None)
+        return REACHED
+
+# Runtime statistics of a task, only collected when enabled in the event loop.
+# The statistics are kept per task name, so they survive the task.
+class TaskStats:
+
+    __slots__ = ("activations", "run_time_sum", "run_time_max",
+                 "lateness_sum", "lateness_max")
+
+    def __init__(self):
+        self.activations = 0
+        # duration [ms] of the task activations
+        self.run_time_sum = 0
+        self.run_time_max = 0
+        # time [ms] from the wake time until the activation
+        self.lateness_sum = 0
+        self.lateness_max = 0
+
+# Statistics of the loop passes, only collected when enabled in the event loop.
+class LoopStats:
+
+    def __init__(self):
+        self.start_time = time_ms()
+        self.passes = 0
+        self.last_pass_time = None
+        # time [ms] between the start of two loop passes
+        self.pass_interval_min = None
+        self.pass_interval_max = 0
+        # time [ms] the loop was sleeping
+        self.idle_time = 0
+
+    def add_pass(self, time_now):
+        self.passes += 1
+        if self.last_pass_time is not None:
+            pass_interval = time_now - self.last_pass_time
+            if self.pass_interval_min is None or pass_interval < self.pass_interval_min:
+                self.pass_interval_min = pass_interval
+            if pass_interval > self.pass_interval_max:
+                self.pass_interval_max = pass_interval
+        self.last_pass_time = time_now
+
+    # Returns the deviation [ms] of the tick period.
+    def jitter(self):
+        if self.pass_interval_min is None:
+            return 0
+        return self.pass_interval_max - self.pass_interval_min
+
+    # Returns the sleeping time in percent of the measurement time.
+    def idle_percent(self):
+        measurement_time = time_ms() - self.start_time
+        if measurement_time <= 0:
+            return 0
+        return (self.idle_time * 100) // measurement_time
+
+# Task priorities, tasks with a lower value are dispatched first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_COUNT = 3
+
+# Task states.
+TASK_POLLED = 0
+TASK_WAITING = 1
+TASK_READY = 2
+TASK_RUNNABLE = 3
+TASK_DONE = 4
+
+# Number of finished tasks whose result is kept for a waiter that subscribes
+# after the task has finished.
+FINISHED_TASK_CAPACITY = 16
+
+# Record of a registered task, it is updated in place by the event loop.
+# When the task is finished it keeps the return value or the exception and
+# wakes the tasks that are waiting for it.
+class Task:
+
+    __slots__ = ("generator", "name", "criteria", "state", "wake_time",
+                 "timer_sequence", "heap_index", "return_value", "exception",
+                 "waiters", "overruns", "priority", "event_value",
+                 "event_exception", "group", "start_time", "deadline",
+                 "stats", "parents")
+
+    def __init__(self, generator, name, priority, group):
+        self.generator = generator
+        self.name = name
+        self.priority = priority
+        self.group = group
+        self.start_time = time_ms()
+        # time when the task is cancelled by the event loop (None: no limit)
+        self.deadline = None
+        # runtime statistics (None: disabled)
+        self.stats = None
+        self.criteria = None
+        self.state = TASK_POLLED
+        self.wake_time = 0
+        self.timer_sequence = 0
+        # index in the timers (-1: not in the timers)
+        self.heap_index = -1
+        self.return_value = None
+        self.exception = None
+        # list of waiting tasks, created on demand
+        self.waiters = None
+        # number of missed periods
+        self.overruns = 0
+        # result of the condition until the task is dispatched
+        self.event_value = None
+        self.event_exception = None
+        # suspended parent generators of a running sub-generator, created on
+        # demand
+        self.parents = None
 
 class EventLoop:
 
     def __init__(self):
+        # Tasks with polled conditions, these are tested on every loop pass.
         self.tasks = []
-        self.task_names = set()
+        # Tasks that are waiting for a time, ordered by wake time.
+        self.timers = []
+        self.timer_sequence = 0
+        # Tasks with a reached wake time and tasks that are woken by an event.
+        # The lists are reused on each loop pass to avoid allocations.
+        self.due_tasks = []
+        self.ready_tasks = []
+        # Tasks with a reached condition, ordered by priority and wake time.
+        self.runnable_tasks = []
+        # Time [ms] from the wake time to the dispatch per priority.
+        self.dispatch_counts = [0] * PRIORITY_COUNT
+        self.dispatch_latency_sums = [0] * PRIORITY_COUNT
+        self.dispatch_latency_maxs = [0] * PRIORITY_COUNT
+        # Registered tasks that are not finished.
+        self.task_map = {}
+        self.task_count = 0
+        # Finished tasks, the oldest first, for tasks that wait for them
+        # later. The record is removed when the name is reused or when more
+        # than FINISHED_TASK_CAPACITY tasks have finished.
+        self.finished_tasks = []
+        self.overruns = 0
         self.next_default_task_name = 0
-        self.last_task_return_value = None
+        self.input_poll = None
+        # Tasks that are woken when data are received on stdin.
+        self.input_waiters = []
+        self.current_task = None
+        # Runtime statistics, they cost nothing when disabled.
+        self.stats_enabled = False
+        self.task_stats_map = {}
+        self.loop_stats = None
 
     def run(self, poll_time):
-        while len(self.tasks) > 0:
+        self.run_ms(int(poll_time * 1000))
+
+    def run_ms(self, poll_time_ms):
+        while self.task_count > 0:
+            self.process_next_events()
+            self.sleep_ms(poll_time_ms, False)
+
+    def run_tickless(self, poll_time):
+        self.run_tickless_ms(int(poll_time * 1000))
+
+    # Runs the tasks without a fixed poll cycle. The loop sleeps until the next
+    # wake time is reached or data are received on stdin. The poll_time_ms is
+    # only used as maximum sleep time when tasks with polled conditions exist.
+    def run_tickless_ms(self, poll_time_ms):
+        self.register_input_poll()
+        while self.task_count > 0:
             self.process_next_events()
-            time_sleep(poll_time)
+            if len(self.ready_tasks) > 0:
+                # tasks have been woken during the loop pass
+                continue
+            sleep_time_ms = self.sleep_time_ms(poll_time_ms)
+            # When received data are not consumed yet by a task then only the
+            # wake time can be used to avoid a busy loop.
+            self.sleep_ms(sleep_time_ms, not poll_ready(self.input_poll, 0))
+
+    def register_input_poll(self):
+        if self.input_poll is None:
+            self.input_poll = poll()
+            self.input_poll.register(stdin)
+
+    # Returns True when received data are available on stdin.
+    def input_ready(self):
+        self.register_input_poll()
+        return poll_ready(self.input_poll, 0)
+
+    # Lets the task wait for data on stdin (e.g. WaitForConsoleLine).
+    def add_input_waiter(self, task):
+        if task not in self.input_waiters:
+            self.input_waiters.append(task)
+
+    def remove_input_waiter(self, task):
+        if task in self.input_waiters:
+            self.input_waiters.remove(task)
+
+    # Wakes the tasks that wait for data when data are received, stdin is
+    # only polled while such tasks exist.
+    def wake_input_waiters(self):
+        if len(self.input_waiters) == 0 or not self.input_ready():
+            return
+        for task in self.input_waiters:
+            self.wake_task(task)
+
+    # Sleeps until the time is over or optionally until data are received.
+    def sleep_ms(self, sleep_time_ms, wake_on_input):
+        if self.stats_enabled:
+            sleep_start_time = time_ms()
+        if wake_on_input:
+            poll_ready(self.input_poll, sleep_time_ms)
+        else:
+            time_sleep_ms(sleep_time_ms)
+        if self.stats_enabled:
+            self.loop_stats.idle_time += time_ms() - sleep_start_time
 
+    # Returns the time [ms] until the next loop pass is needed.
+    def sleep_time_ms(self, poll_time_ms):
+        wake_time = self.next_wake_time()
+        if wake_time is None:
+            return poll_time_ms
+        sleep_time_ms = wake_time - time_ms()
+        if sleep_time_ms < 0:
+            return 0
+        if len(self.tasks) > 0 and sleep_time_ms > poll_time_ms:
+            # polled conditions cannot report a wake time: fixed polling
+            return poll_time_ms
+        return sleep_time_ms
+
+    # Returns the earliest wake time of all waiting tasks (None: no time known).
+    def next_wake_time(self):
+        if len(self.timers) > 0:
+            return self.timers[0].wake_time
+        return None
+
+    # A loop pass allocates no memory as long as no task changes its state.
     def process_next_events(self):
-        tasks_copy = self.tasks
-        self.tasks = []
-        for task_entry in tasks_copy:
-            event_criteria, task, task_name = task_entry
+        # Only the tasks with a reached wake time are taken from the timers,
+        # all other timed tasks are not touched.
+        time_now = time_ms()
+        next_loop_pass()
+        if self.stats_enabled:
+            self.loop_stats.add_pass(time_now)
+        timers = self.timers
+        while len(timers) > 0 and timers[0].wake_time <= time_now:
+            task = heap_pop(timers)
+            if task.deadline is not None and task.deadline <= time_now:
+                # the task has exceeded its time limit
+                self.cancel_task(task, TimeoutException(time_now - task.start_time))
+                continue
+            task.state = TASK_READY
+            self.due_tasks.append(task)
+        self.wake_input_waiters()
+        # The conditions of all tasks are tested first, afterwards the tasks
+        # with a reached condition are dispatched by priority and wake time.
+        self.test_task_list(self.due_tasks, time_now)
+        self.test_task_list(self.ready_tasks, time_now)
+        self.test_task_list(self.tasks, time_now)
+        self.dispatch_runnable_tasks()
+
+    # Tests the tasks that are in the list when the testing starts. Polled
+    # tasks that are still waiting stay in the list, tasks that are added to
+    # the list during the testing are kept for the next pass.
+    def test_task_list(self, task_list, time_now):
+        task_count = len(task_list)
+        if task_count == 0:
+            return
+        kept_count = 0
+        index = 0
+        while index < task_count:
+            task = task_list[index]
+            index += 1
+            if self.test_task(task, time_now):
+                task_list[kept_count] = task
+                kept_count += 1
+        if kept_count == task_count:
+            return
+        while index < len(task_list):
+            task_list[kept_count] = task_list[index]
+            kept_count += 1
+            index += 1
+        while len(task_list) > kept_count:
+            task_list.pop()
+
+    # Returns True when the task still waits for its polled condition.
+    def test_task(self, task, time_now):
+        event_criteria = task.criteria
+        try:
+            is_event, event_value = event_criteria.test_event(self)
+        except Exception as criteria_exception:
+            # there is an exception when checking the criteria:
+            # the exception is sent to the task, the other children of a
+            # composite condition shall not wake the task anymore
+            event_criteria.unsubscribe(self, task)
+            task.event_exception = criteria_exception
+            self.add_runnable_task(task, time_now)
+            return False
+        if is_event:
+            task.event_value = event_value
+            self.add_runnable_task(task, time_now)
+            return False
+        if event_criteria.polled:
+            # task not activated, stays in the polled tasks
+            return True
+        # task not activated, must wait again
+        self.wait_for(task, event_criteria, False)
+        return False
+
+    # Inserts a task with a reached condition into the runnable tasks.
+    def add_runnable_task(self, task, time_now):
+        if task.state == TASK_POLLED:
+            # polled conditions have no wake time: ready since this pass
+            task.wake_time = time_now
+            if task.heap_index >= 0:
+                # the timer is only used for the deadline
+                heap_remove(self.timers, task)
+        task.state = TASK_RUNNABLE
+        runnable_tasks = self.runnable_tasks
+        index = len(runnable_tasks)
+        while index > 0:
+            other_task = runnable_tasks[index - 1]
+            if other_task.priority < task.priority:
+                break
+            if other_task.priority == task.priority and other_task.wake_time <= task.wake_time:
+                break
+            index -= 1
+        runnable_tasks.insert(index, task)
+
+    # Activates the runnable tasks and obtains their next criteria.
+    def dispatch_runnable_tasks(self):
+        runnable_tasks = self.runnable_tasks
+        index = 0
+        while index < len(runnable_tasks):
+            task = runnable_tasks[index]
+            index += 1
+            if task.state != TASK_RUNNABLE:
+                # task has been cancelled
+                continue
+            priority = task.priority
+            dispatch_time = time_ms()
+            latency = dispatch_time - task.wake_time
+            self.dispatch_counts[priority] += 1
+            self.dispatch_latency_sums[priority] += latency
+            if latency > self.dispatch_latency_maxs[priority]:
+                self.dispatch_latency_maxs[priority] = latency
+            event_value = task.event_value
+            event_exception = task.event_exception
+            task.event_value = None
+            task.event_exception = None
+            self.activate_task(task, event_value, event_exception)
+            if self.stats_enabled:
+                self.add_task_stats(task, latency, time_ms() - dispatch_time)
+        while len(runnable_tasks) > 0:
+            runnable_tasks.pop()
+
+    # Returns (dispatch count, average latency [ms], max latency [ms]) of the
+    # tasks with the priority. The latency is the time from the wake time of a
+    # task (or the loop pass of a polled task) until the task is dispatched.
+    def dispatch_latency(self, priority):
+        dispatch_count = self.dispatch_counts[priority]
+        if dispatch_count == 0:
+            return (0, 0, 0)
+        return (dispatch_count,
+                self.dispatch_latency_sums[priority] // dispatch_count,
+                self.dispatch_latency_maxs[priority])
+
+    def reset_dispatch_latency(self):
+        for priority in range(PRIORITY_COUNT):
+            self.dispatch_counts[priority] = 0
+            self.dispatch_latency_sums[priority] = 0
+            self.dispatch_latency_maxs[priority] = 0
+
+    # Enables the collection of runtime statistics.
+    def enable_stats(self):
+        if self.loop_stats is None:
+            self.loop_stats = LoopStats()
+        self.stats_enabled = True
+
+    # Disables the collection of runtime statistics, collected are kept.
+    def disable_stats(self):
+        self.stats_enabled = False
+
+    def reset_stats(self):
+        self.task_stats_map = {}
+        for task in self.task_map.values():
+            task.stats = None
+        if self.loop_stats is not None:
+            self.loop_stats = LoopStats()
+
+    def add_task_stats(self, task, lateness, run_time):
+        stats = task.stats
+        if stats is None:
+            stats = self.task_stats_map.get(task.name)
+            if stats is None:
+                stats = TaskStats()
+                self.task_stats_map[task.name] = stats
+            task.stats = stats
+        stats.activations += 1
+        stats.run_time_sum += run_time
+        if run_time > stats.run_time_max:
+            stats.run_time_max = run_time
+        stats.lateness_sum += lateness
+        if lateness > stats.lateness_max:
+            stats.lateness_max = lateness
+
+    # Returns the runtime statistics of a task name (None: no statistics).
+    def task_stats(self, task_name):
+        return self.task_stats_map.get(task_name)
+
+    def print_stats(self):
+        if self.loop_stats is None:
+            print("statistics are not enabled")
+            return
+        print("loop passes =", self.loop_stats.passes,
+              "jitter =", self.loop_stats.jitter(),
+              "idle % =", self.loop_stats.idle_percent())
+        for task_name, stats in self.task_stats_map.items():
+            print(task_name,
+                  "activations =", stats.activations,
+                  "run time sum =", stats.run_time_sum,
+                  "max =", stats.run_time_max,
+                  "lateness max =", stats.lateness_max)
+
+    # Resumes the task with a value or an exception. A task can yield a
+    # generator (sub-generator), it runs inside the slot of the task until it
+    # is finished, then the parent receives its return value or exception.
+    def activate_task(self, task, event_value, event_exception):
+        global s_current_task_name
+        self.current_task = task
+        s_current_task_name = task.name
+        while True:
             try:
-                is_event, event_value = event_criteria.test_event(self)
-                if is_event:
-                    try:
-                        # activate the task and obtain the next criteria
-                        task_next_criteria = task.send(event_value)
-                        self.register_task(task, task_name, task_next_criteria)
-                    except StopIteration as ex:
-                        # task finished, store the return value
-                        self.save_task_return_value(task_name, ex.value)
-                        # forget name and don't register it again
-                        self.task_names.remove(task_name)
+                if event_exception is None:
+                    task_next_criteria = task.generator.send(event_value)
                 else:
-                    # task not activated, must be registered again
-                    self.register_task(task, task_name, event_criteria)
-            except Exception as criteria_exception:
-                # there is an exception when checking the criteria
-                try:
-                    # send exception to the task and obtain the next criteria
-                    task_next_criteria = task.throw(criteria_exception)
-                    self.register_task(task, task_name, task_next_criteria)
-                except StopIteration as ex:
-                    # task finished, store the return value
-                    self.save_task_return_value(task_name, ex.value)
-                    # forget name and don't register it again
-                    self.task_names.remove(task_name)
-
-    def register_task(self, task, task_name=None, event_criteria=WaitFor()):
+                    task_next_criteria = task.generator.throw(event_exception)
+            except StopIteration as ex:
+                if self.pop_generator(task):
+                    # sub-generator finished, the parent continues
+                    event_value = ex.value
+                    event_exception = None
+                    continue
+                # task finished, store the return value
+                self.current_task = None
+                s_current_task_name = None
+                self.finish_task(task, ex.value, None)
+                return
+            except Exception as ex:
+                if self.pop_generator(task):
+                    # sub-generator failed, the parent receives the exception
+                    event_value = None
+                    event_exception = ex
+                    continue
+                # task finished with an exception, the waiting tasks receive it
+                self.current_task = None
+                s_current_task_name = None
+                self.finish_task(task, None, ex)
+                if task.waiters is None or len(task.waiters) == 0:
+                    raise
+                return
+            if type(task_next_criteria) is not GENERATOR_TYPE:
+                break
+            # start the sub-generator
+            self.push_generator(task, task_next_criteria)
+            event_value = None
+            event_exception = None
+        self.current_task = None
+        s_current_task_name = None
+        self.wait_for(task, task_next_criteria, True)
+
+    # Suspends the running generator of the task and runs the sub-generator.
+    def push_generator(self, task, generator):
+        if task.parents is None:
+            task.parents = []
+        task.parents.append(task.generator)
+        task.generator = generator
+
+    # Continues the parent of a finished sub-generator. Returns False when the
+    # task has no parent (the task itself is finished).
+    def pop_generator(self, task):
+        parents = task.parents
+        if parents is None or len(parents) == 0:
+            return False
+        task.generator = parents.pop()
+        return True
+
+    # Lets the task wait for the condition. A task can also yield an int,
+    # this is a sleep time [ms] without allocation of a condition. A float is
+    # rejected, floats are seconds in this library (e.g. WaitForRelativeTime).
+    def wait_for(self, task, event_criteria, subscribe):
+        if isinstance(event_criteria, int):
+            task.criteria = s_sleep
+            task.state = TASK_WAITING
+            self.add_timer(task, time_ms() + event_criteria)
+            return
+        if isinstance(event_criteria, float):
+            raise TypeError("sleep time must be an int [ms]")
+        task.criteria = event_criteria
+        if event_criteria.polled:
+            task.state = TASK_POLLED
+            self.tasks.append(task)
+            if subscribe:
+                # e.g. the children of a composite condition
+                event_criteria.subscribe(self, task)
+            if task.deadline is not None:
+                self.add_timer(task, None)
+            return
+        task.state = TASK_WAITING
+        if subscribe:
+            event_criteria.subscribe(self, task)
+            if task.state != TASK_WAITING:
+                # task has been woken by the subscription
+                return
+        self.add_timer(task, event_criteria.wake_time())
+
+    # Adds a task to the timers, the deadline of the task limits the wake time.
+    def add_timer(self, task, wake_time):
+        if task.deadline is not None:
+            if wake_time is None or task.deadline < wake_time:
+                wake_time = task.deadline
+        if wake_time is None:
+            return
+        # The sequence keeps the registration order for equal wake times.
+        task.wake_time = wake_time
+        task.timer_sequence = self.timer_sequence
+        self.timer_sequence += 1
+        heap_push(self.timers, task)
+
+    # Makes a task that waits for a not polled condition runnable. A sleep
+    # only ends by its timer, a stale wake does not shorten it.
+    def wake_task(self, task):
+        if task.state != TASK_WAITING or task.criteria is s_sleep:
+            return
+        if task.heap_index >= 0:
+            heap_remove(self.timers, task)
+        task.state = TASK_READY
+        task.wake_time = time_ms()
+        self.ready_tasks.append(task)
+
+    # Adds a task to the waiting tasks of another task.
+    def add_waiter(self, task, waiter):
+        if task.waiters is None:
+            task.waiters = []
+        task.waiters.append(waiter)
+
+    # Removes a task from the waiting tasks of another task.
+    def remove_waiter(self, task, waiter):
+        if task.waiters is not None and waiter in task.waiters:
+            task.waiters.remove(waiter)
+
+    # Stores the result of a finished task and wakes the waiting tasks.
+    def finish_task(self, task, return_value, exception):
+        task.state = TASK_DONE
+        self.task_count -= 1
+        task.return_value = return_value
+        task.exception = exception
+        if self.task_map.get(task.name) is task:
+            # forget name
+            del self.task_map[task.name]
+            # keep the result for later waiters
+            if len(self.finished_tasks) >= FINISHED_TASK_CAPACITY:
+                self.finished_tasks.pop(0)
+            self.finished_tasks.append(task)
+        if task.waiters is not None:
+            for waiter in task.waiters:
+                self.wake_task(waiter)
+            task.waiters = None
+
+    # Cancels a task immediately: a CancelledException is thrown into the task,
+    # so the task can clean up (e.g. stop a motor) in a finally clause. Tasks
+    # waiting for the cancelled task receive the exception. A task cannot
+    # cancel itself. Returns True when the task has been cancelled.
+    def cancel(self, task_name):
+        task = self.task_map.get(task_name)
+        if task is None or task is self.current_task:
+            return False
+        self.cancel_task(task, CancelledException(task_name))
+        return True
+
+    # Cancels all tasks of a group.
+    def cancel_group(self, group):
+        for task in list(self.task_map.values()):
+            if task.group == group and task is not self.current_task:
+                self.cancel_task(task, CancelledException(task.name))
+
+    # Cancels all tasks except the running task.
+    def cancel_all(self):
+        for task in list(self.task_map.values()):
+            if task is not self.current_task:
+                self.cancel_task(task, CancelledException(task.name))
+
+    # The exception is thrown into the running sub-generator first and then
+    # into each parent, so all of them can clean up.
+    def cancel_task(self, task, exception):
+        self.remove_waiting_task(task)
+        task_exception = exception
+        while True:
+            try:
+                task.generator.throw(task_exception)
+                # the task has caught the exception and is still running
+                task.generator.close()
+            except StopIteration:
+                pass
+            except Exception as ex:
+                # normally the thrown exception
+                task_exception = ex
+            if not self.pop_generator(task):
+                break
+        self.finish_task(task, None, task_exception)
+
+    # Removes a task from the tasks lists and from the timers.
+    def remove_waiting_task(self, task):
+        if task.heap_index >= 0:
+            heap_remove(self.timers, task)
+        if task.state == TASK_POLLED:
+            self.tasks.remove(task)
+            task.criteria.unsubscribe(self, task)
+        elif task.state == TASK_WAITING:
+            task.criteria.unsubscribe(self, task)
+        elif task.state == TASK_READY:
+            task.criteria.unsubscribe(self, task)
+            if task in self.ready_tasks:
+                self.ready_tasks.remove(task)
+            elif task in self.due_tasks:
+                self.due_tasks.remove(task)
+
+    # Registers a task. Tasks of a group can be cancelled together, a task
+    # with a timeout_ms is cancelled by the event loop when the time is over.
+    def register_task(self, task, task_name=None, event_criteria=WaitFor(), priority=PRIORITY_NORMAL, group=None, timeout_ms=None):
         if task_name == None:
             task_name = str(self.next_default_task_name)
             self.next_default_task_name += 1
-        self.tasks.append((event_criteria, task, task_name))
-        self.task_names.add(task_name)
+        self.remove_finished_task(task_name)
+        task_record = Task(task, task_name, priority, group)
+        if timeout_ms is not None:
+            task_record.deadline = task_record.start_time + timeout_ms
+        self.task_map[task_name] = task_record
+        self.task_count += 1
+        self.wait_for(task_record, event_criteria, True)
         return task_name
 
     def task_exists(self, task_name):
-        return (task_name in self.task_names)
+        return (task_name in self.task_map)
 
-    def save_task_return_value(self, task_name, task_return_value):
-        self.last_task_return_value = task_return_value
+    # Counts missed periods of a task.
+    def add_overruns(self, task, overruns):
+        task.overruns += overruns
+        self.overruns += overruns
 
-    def task_return_value(self, task_name):
-        return self.last_task_return_value
+    # Returns the number of missed periods of a task (None: unknown task).
+    def task_overruns(self, task_name):
+        task = self.task_map.get(task_name)
+        if task is None:
+            return None
+        return task.overruns
 
-class WaitForAbsoluteTime(WaitFor):
+    # Returns the record of a registered task that is not finished.
+    def find_task(self, task_name):
+        return self.task_map.get(task_name)
 
-    def __init__(self, absolute_time):
+    # Returns the kept record of a finished task (None: unknown or evicted).
+    def find_finished_task(self, task_name):
+        for task in self.finished_tasks:
+            if task.name == task_name:
+                return task
+        return None
+
+    # Forgets the finished task, e.g. when its name is registered again.
+    def remove_finished_task(self, task_name):
+        finished_tasks = self.finished_tasks
+        for index in range(len(finished_tasks)):
+            if finished_tasks[index].name == task_name:
+                finished_tasks.pop(index)
+                return
+
+class WaitForAbsoluteTimeMs(WaitFor):
+
+    # The event loop keeps this condition in the timers until it is reached.
+    polled = False
+
+    def __init__(self, absolute_time_ms):
         super().__init__()
-        self.absolute_time = absolute_time
+        self.absolute_time_ms = absolute_time_ms
+
+    def wake_time(self):
+        return self.absolute_time_ms
+
+    def test_event(self, event_loop):
+        time_now = time_ms()
+        return (self.absolute_time_ms <= time_now, time_now)
+
+class WaitForRelativeTimeMs(WaitForAbsoluteTimeMs):
+
+    def __init__(self, relative_time_ms):
+        super().__init__(time_ms() + relative_time_ms)
+
+# Reusable timer: each time the condition is yielded it waits the interval
+# from now on. The same object can be yielded again by the same task, so a
+# periodic task allocates nothing per iteration. The task receives None.
+class WaitForIntervalMs(WaitForAbsoluteTimeMs):
+
+    def __init__(self, interval_ms):
+        super().__init__(0)
+        self.interval_ms = interval_ms
+
+    def subscribe(self, event_loop, task):
+        self.absolute_time_ms = time_ms() + self.interval_ms
+
+    def test_event(self, event_loop):
+        if self.absolute_time_ms <= time_ms():
+            return REACHED
+        return NOT_REACHED
+
+# Periodic timer with a fixed phase: the next wake time is the previous wake
+# time plus the period, so the work time of the task causes no drift. The same
+# object is yielded again in each iteration. The task receives the number of
+# missed periods, these are also counted by the event loop as overruns.
+class WaitForPeriodMs(WaitForAbsoluteTimeMs):
+
+    def __init__(self, period_ms):
+        super().__init__(time_ms())
+        self.period_ms = period_ms
+        self.waiting_task = None
+
+    def subscribe(self, event_loop, task):
+        self.absolute_time_ms += self.period_ms
+        self.waiting_task = task
+
+    def test_event(self, event_loop):
+        time_now = time_ms()
+        if self.absolute_time_ms > time_now:
+            return NOT_REACHED
+        missed_periods = (time_now - self.absolute_time_ms) // self.period_ms
+        if missed_periods == 0:
+            return REACHED_IN_TIME
+        # skip the missed periods but keep the phase
+        self.absolute_time_ms += missed_periods * self.period_ms
+        event_loop.add_overruns(self.waiting_task, missed_periods)
+        return (True, missed_periods)
+
+# Condition of a task that has yielded a number, the sleep time is only kept
+# in the task record. The event loop uses a single instance.
+class WaitForSleep(WaitFor):
+
+    polled = False
+
+    def test_event(self, event_loop):
+        # the task is only tested when the wake time is reached
+        return REACHED
+
+s_sleep = WaitForSleep()
+
+# Wrapper with time in seconds.
+class WaitForAbsoluteTime(WaitForAbsoluteTimeMs):
+
+    def __init__(self, absolute_time):
+        super().__init__(int(absolute_time * 1000))
 
     def test_event(self, event_loop):
-        time_now = time_time()
-        return (self.absolute_time <= time_now, time_now)
+        is_event, time_now = super().test_event(event_loop)
+        return (is_event, time_now / 1000)
 
+# Wrapper with time in seconds.
 class WaitForRelativeTime(WaitForAbsoluteTime):
 
     def __init__(self, relative_time):
-        super().__init__(time_time() + relative_time)
+        WaitForAbsoluteTimeMs.__init__(self, time_ms() + int(relative_time * 1000))
 
-class WaitForTaskCompleted(WaitFor):
+# The waiting task is woken by the event loop when the task is finished,
+# the timeout is handled via the wake time.
+class WaitForTaskCompletedMs(WaitFor):
 
-    def __init__(self, task_name, timeout=None):
+    polled = False
+
+    def __init__(self, task_name, timeout_ms=None):
         super().__init__()
         self.task_name = task_name
-        self.timeout = timeout
-        self.start_time = time_time()
+        self.timeout_ms = timeout_ms
+        self.start_time_ms = time_ms()
+        self.task = None
+        self.waiting_task = None
+
+    def wake_time(self):
+        if self.timeout_ms is None:
+            return None
+        return self.start_time_ms + self.timeout_ms
+
+    def subscribe(self, event_loop, task):
+        self.task = event_loop.find_task(self.task_name)
+        if self.task is None:
+            # task has finished: the result is read from its kept record
+            # (None: the record has been evicted or the task never ran)
+            self.task = event_loop.find_finished_task(self.task_name)
+            event_loop.wake_task(task)
+        else:
+            self.waiting_task = task
+            event_loop.add_waiter(self.task, task)
+
+    def unsubscribe(self, event_loop, task):
+        if self.task is not None:
+            event_loop.remove_waiter(self.task, task)
 
     def test_event(self, event_loop):
-        if event_loop.task_exists(self.task_name):
+        if self.task is None:
+            # task has finished (or was never running)
+            return REACHED
+        if self.task.state != TASK_DONE:
             # task is still running, check the timeout
-            if self.timeout is not None:
-                wait_time = time_time() - self.start_time
-                if wait_time >= self.timeout:
-                    raise TimeoutException(wait_time)
+            if self.timeout_ms is not None:
+                wait_time_ms = time_ms() - self.start_time_ms
+                if wait_time_ms >= self.timeout_ms:
+                    event_loop.remove_waiter(self.task, self.waiting_task)
+                    raise TimeoutException(self.timeout_value(wait_time_ms))
             # still have to wait
-            return (False, None)
-        # task has finished (or was never running)
-        return (True, event_loop.task_return_value(self.task_name))
\ No newline at end of file
+            return NOT_REACHED
+        if self.task.exception is not None:
+            raise self.task.exception
+        return (True, self.task.return_value)
+
+    # Value of the TimeoutException.
+    def timeout_value(self, wait_time_ms):
+        return wait_time_ms
+
+# Wrapper with time in seconds.
+class WaitForTaskCompleted(WaitForTaskCompletedMs):
+
+    def __init__(self, task_name, timeout=None):
+        if timeout is None:
+            super().__init__(task_name)
+        else:
+            super().__init__(task_name, int(timeout * 1000))
+
+    def timeout_value(self, wait_time_ms):
+        return wait_time_ms / 1000
+
+# Base of the composite conditions. The children are subscribed with the task
+# of the composite condition, so children with events (e.g.
+# WaitForTaskCompletedMs) wake the task directly. The composite condition is
+# polled when a child is polled, otherwise the task waits in the timers until
+# the earliest wake time of the children.
+class WaitForComposite(WaitFor):
+
+    def __init__(self, *conditions):
+        super().__init__()
+        self.conditions = conditions
+        self.polled = False
+        for condition in conditions:
+            if condition.polled:
+                self.polled = True
+        self.waiting_task = None
+
+    def subscribe(self, event_loop, task):
+        self.waiting_task = task
+        for condition in self.conditions:
+            condition.subscribe(event_loop, task)
+
+    def unsubscribe(self, event_loop, task):
+        for condition in self.conditions:
+            condition.unsubscribe(event_loop, task)
+
+    # Returns the earliest wake time of the children that are still waiting.
+    def wake_time(self):
+        wake_time = None
+        for index in range(len(self.conditions)):
+            if self.child_reached(index):
+                continue
+            child_wake_time = self.conditions[index].wake_time()
+            if child_wake_time is not None and (wake_time is None or child_wake_time < wake_time):
+                wake_time = child_wake_time
+        return wake_time
+
+    def child_reached(self, index):
+        return False
+
+# Reached when one of the conditions is reached. The conditions are tested in
+# the given order and the testing stops at the first reached condition. The
+# task receives the index of this condition, its value is kept in value.
+class WaitForAny(WaitForComposite):
+
+    def __init__(self, *conditions):
+        super().__init__(*conditions)
+        self.fired_index = None
+        self.value = None
+
+    def subscribe(self, event_loop, task):
+        self.fired_index = None
+        self.value = None
+        super().subscribe(event_loop, task)
+
+    def test_event(self, event_loop):
+        conditions = self.conditions
+        index = 0
+        while index < len(conditions):
+            is_event, event_value = conditions[index].test_event(event_loop)
+            if is_event:
+                self.fired_index = index
+                self.value = event_value
+                # the other conditions shall not wake the task anymore
+                self.unsubscribe(event_loop, self.waiting_task)
+                return (True, index)
+            index += 1
+        return NOT_REACHED
+
+# Reached when all conditions are reached. Reached conditions are not tested
+# again and the testing stops at the first condition that is not reached.
+# The task receives the list of the values of the conditions.
+class WaitForAll(WaitForComposite):
+
+    def __init__(self, *conditions):
+        super().__init__(*conditions)
+        self.reached = [False] * len(conditions)
+        self.values = [None] * len(conditions)
+
+    def subscribe(self, event_loop, task):
+        for index in range(len(self.conditions)):
+            self.reached[index] = False
+            self.values[index] = None
+        super().subscribe(event_loop, task)
+
+    def child_reached(self, index):
+        return self.reached[index]
+
+    def test_event(self, event_loop):
+        conditions = self.conditions
+        index = 0
+        while index < len(conditions):
+            if not self.reached[index]:
+                is_event, event_value = conditions[index].test_event(event_loop)
+                if not is_event:
+                    return NOT_REACHED
+                self.reached[index] = True
+                self.values[index] = event_value
+            index += 1
+        return (True, self.values)
+
+# Base of the signals between tasks. Tasks that wait for a signal are not
+# tested in the loop passes, the signal makes them runnable when it is ready.
+class Signal:
+
+    def __init__(self):
+        self.waiters = []
+        self.event_loop = None
+
+    # Returns True when waiting tasks can continue.
+    def is_ready(self):
+        return False
+
+    def add_waiter(self, event_loop, task):
+        self.event_loop = event_loop
+        if task not in self.waiters:
+            self.waiters.append(task)
+        if self.is_ready():
+            event_loop.wake_task(task)
+
+    def remove_waiter(self, task):
+        if task in self.waiters:
+            self.waiters.remove(task)
+
+    def wake_waiters(self):
+        if self.event_loop is None:
+            return
+        for task in self.waiters:
+            self.event_loop.wake_task(task)
+
+# Event that is set by a producer, e.g. a command handler. The event stays set
+# until clear() is called.
+class Event(Signal):
+
+    def __init__(self):
+        super().__init__()
+        self.is_set = False
+
+    def is_ready(self):
+        return self.is_set
+
+    def set(self):
+        self.is_set = True
+        self.wake_waiters()
+
+    def clear(self):
+        self.is_set = False
+
+    # Returns a new condition, a task can also yield the same WaitForEvent
+    # repeatedly.
+    def wait(self, auto_clear=False):
+        return WaitForEvent(self, auto_clear)
+
+# Queue of items between tasks: put() wakes the waiting tasks, the first task
+# that is tested receives the item.
+class Queue(Signal):
+
+    def __init__(self):
+        super().__init__()
+        self.items = []
+
+    def is_ready(self):
+        return len(self.items) > 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        self.items.append(item)
+        self.wake_waiters()
+
+    # Removes all items.
+    def clear(self):
+        while len(self.items) > 0:
+            self.items.pop()
+
+    # Raises an IndexError when the queue is empty.
+    def get_nowait(self):
+        return self.items.pop(0)
+
+    # Returns a new condition, a task can also yield the same WaitForQueueItem
+    # repeatedly.
+    def get(self):
+        return WaitForQueueItem(self)
+
+# Reached when the event is set, optionally the event is cleared then.
+class WaitForEvent(WaitFor):
+
+    polled = False
+
+    def __init__(self, event, auto_clear=False):
+        super().__init__()
+        self.event = event
+        self.auto_clear = auto_clear
+        self.waiting_task = None
+
+    def subscribe(self, event_loop, task):
+        self.waiting_task = task
+        self.event.add_waiter(event_loop, task)
+
+    def unsubscribe(self, event_loop, task):
+        self.event.remove_waiter(task)
+
+    def test_event(self, event_loop):
+        if not self.event.is_set:
+            return NOT_REACHED
+        self.event.remove_waiter(self.waiting_task)
+        if self.auto_clear:
+            self.event.clear()
+        return REACHED
+
+# Reached when the queue has an item, the task receives the item.
+class WaitForQueueItem(WaitFor):
+
+    polled = False
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        self.waiting_task = None
+
+    def subscribe(self, event_loop, task):
+        self.waiting_task = task
+        self.queue.add_waiter(event_loop, task)
+
+    def unsubscribe(self, event_loop, task):
+        self.queue.remove_waiter(task)
+
+    def test_event(self, event_loop):
+        if len(self.queue.items) == 0:
+            # another task has received the item
+            return NOT_REACHED
+        self.queue.remove_waiter(self.waiting_task)
+        return (True, self.queue.items.pop(0))
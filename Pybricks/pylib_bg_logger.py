@@ -1,12 +1,132 @@
 #******************************************************************************
 # Logger for background tasks.                                                *
 #******************************************************************************
+from pylib_async import current_task_name, time_ms
+
+# Log levels, a message is only stored when its level reaches the threshold
+# of its module.
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+
+LOG_LEVEL_NAMES = {LOG_DEBUG: "DEBUG", LOG_INFO: "INFO", LOG_WARNING: "WARNING", LOG_ERROR: "ERROR"}
+
+# Policies when the log buffer is full.
+LOG_OVERWRITE_OLDEST = 0
+LOG_DROP_NEWEST = 1
+
+LOG_CAPACITY = 64
+
+# Key of the streamed log records, a record is one line:
+# "%LOG%<time ms>|<level>|<task>|<module>|<message>".
+LOG_STREAM_KEY = "%LOG%"
+
+# Default of the unused arguments, None can be logged as a value.
+NO_ARG = object()
+
 s_logger = None
+# Threshold of the modules without an own threshold.
+s_log_level = LOG_INFO
+s_module_logs = {}
+
+# Returns the tuple of the used arguments. The log functions take up to four
+# fixed arguments instead of *args, so a call below the threshold does not
+# allocate an argument tuple.
+def make_log_args(arg0, arg1, arg2, arg3):
+    if arg0 is NO_ARG:
+        return ()
+    if arg1 is NO_ARG:
+        return (arg0,)
+    if arg2 is NO_ARG:
+        return (arg0, arg1)
+    if arg3 is NO_ARG:
+        return (arg0, arg1, arg2)
+    return (arg0, arg1, arg2, arg3)
+
+# Log of a module with its own threshold. The message is a template with up to
+# four arguments, it is formatted (template.format(*args)) when the log is
+# printed, so a message below the threshold costs only the call.
+class ModuleLog:
+
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.level = s_log_level
+        # False: the level follows set_bg_log_level() without module
+        self.own_level = False
+
+    # Returns True when messages of the level are stored, can be used to skip
+    # the computation of the arguments.
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, template, arg0=NO_ARG, arg1=NO_ARG, arg2=NO_ARG, arg3=NO_ARG):
+        if level >= self.level:
+            s_logger.log(level, self.module_name, template, make_log_args(arg0, arg1, arg2, arg3))
+
+    def debug(self, template, arg0=NO_ARG, arg1=NO_ARG, arg2=NO_ARG, arg3=NO_ARG):
+        if LOG_DEBUG >= self.level:
+            s_logger.log(LOG_DEBUG, self.module_name, template, make_log_args(arg0, arg1, arg2, arg3))
+
+    def info(self, template, arg0=NO_ARG, arg1=NO_ARG, arg2=NO_ARG, arg3=NO_ARG):
+        if LOG_INFO >= self.level:
+            s_logger.log(LOG_INFO, self.module_name, template, make_log_args(arg0, arg1, arg2, arg3))
+
+    def warning(self, template, arg0=NO_ARG, arg1=NO_ARG, arg2=NO_ARG, arg3=NO_ARG):
+        if LOG_WARNING >= self.level:
+            s_logger.log(LOG_WARNING, self.module_name, template, make_log_args(arg0, arg1, arg2, arg3))
+
+    def error(self, template, arg0=NO_ARG, arg1=NO_ARG, arg2=NO_ARG, arg3=NO_ARG):
+        if LOG_ERROR >= self.level:
+            s_logger.log(LOG_ERROR, self.module_name, template, make_log_args(arg0, arg1, arg2, arg3))
+
+# Returns the log of the module, it is created on the first call.
+def get_module_log(module_name):
+    module_log = s_module_logs.get(module_name)
+    if module_log is None:
+        module_log = ModuleLog(module_name)
+        s_module_logs[module_name] = module_log
+    return module_log
+
+# Sets the threshold of a module or (module_name None) of all modules without
+# an own threshold.
+def set_bg_log_level(level, module_name=None):
+    global s_log_level
+    if module_name is not None:
+        module_log = get_module_log(module_name)
+        module_log.level = level
+        module_log.own_level = True
+        return
+    s_log_level = level
+    for module_log in s_module_logs.values():
+        if not module_log.own_level:
+            module_log.level = level
+
+# Convenience helper that logs an info message without module.
+def bg_log(template, arg0=NO_ARG, arg1=NO_ARG, arg2=NO_ARG, arg3=NO_ARG):
+    if LOG_INFO >= s_log_level:
+        s_logger.log(LOG_INFO, "", template, make_log_args(arg0, arg1, arg2, arg3))
+
+# Replaces the s_logger instance by a logger with the capacity and policy,
+# buffered log messages are lost.
+def configure_bg_logger(capacity=LOG_CAPACITY, policy=LOG_OVERWRITE_OLDEST):
+    global s_logger
+    s_logger = Logger(capacity, policy)
+
+# Convenience helper that delegates to the s_logger instance.
+def enable_bg_log_streaming():
+    global s_logger
+    s_logger.streaming = True
 
 # Convenience helper that delegates to the s_logger instance.
-def bg_log(message):
+def disable_bg_log_streaming():
     global s_logger
-    s_logger.log(message)
+    s_logger.streaming = False
+
+# Convenience helper that delegates to the s_logger instance.
+def bg_log_dropped():
+    global s_logger
+    return s_logger.dropped
 
 # Convenience helper that delegates to the s_logger instance.
 def clean_bg_log_messages():
@@ -16,12 +136,12 @@ def clean_bg_log_messages():
 # Convenience helper that delegates to the s_logger instance.
 def get_bg_log_messages():
     global s_logger
-    s_logger.get_log_messages()
+    return s_logger.get_log_messages()
 
 # Convenience helper that delegates to the s_logger instance.
 def get_bg_log_messages_and_clean():
     global s_logger
-    s_logger.get_log_messages_and_clean()
+    return s_logger.get_log_messages_and_clean()
 
 # Convenience helper that delegates to the s_logger instance.
 def print_bg_log_messages():
@@ -33,40 +153,179 @@ def print_bg_log_messages_and_clean():
     global s_logger
     s_logger.print_log_messages_and_clean()
 
-# The backgound logger instance.
+# Task that prints the log messages in chunks and removes them from the log.
+# A chunk has at most max_entries messages and max_bytes characters, between
+# the chunks the task sleeps pause_ms, so the other tasks keep running while
+# stdout is sent to the PC. Only the messages that are in the log when the
+# task starts are printed. With report_progress the number of printed messages
+# is printed after each chunk. Returns the number of printed messages.
+def drain_bg_log_task(max_entries=8, max_bytes=256, pause_ms=20, report_progress=False):
+    global s_logger
+    total_count = s_logger.count
+    if s_logger.dropped > 0:
+        print(s_logger.dropped, "log messages dropped")
+        s_logger.dropped = 0
+    printed_count = 0
+    while printed_count < total_count:
+        chunk_entries = 0
+        chunk_bytes = 0
+        while printed_count < total_count and chunk_entries < max_entries:
+            message = s_logger.peek_message()
+            if message is None:
+                # the log has been cleaned meanwhile
+                total_count = printed_count
+                break
+            if chunk_entries > 0 and chunk_bytes + len(message) + 1 > max_bytes:
+                break
+            s_logger.remove_message()
+            print(message)
+            chunk_entries += 1
+            chunk_bytes += len(message) + 1
+            printed_count += 1
+        if report_progress:
+            print("log messages printed =", printed_count, "/", total_count)
+        if printed_count < total_count:
+            yield pause_ms
+    return printed_count
+
+# The backgound logger instance. The log messages are kept in a ring buffer
+# with a fixed capacity, so the memory use does not grow when the log is not
+# read. The entries are stored in preallocated lists (level, module, template,
+# arguments) and formatted when they are printed or retrieved. When the buffer
+# is full the oldest message is overwritten (LOG_OVERWRITE_OLDEST) or the new
+# message is dropped (LOG_DROP_NEWEST), the lost messages are counted in
+# dropped. Each entry has the time [ms] and the name of the task that logged
+# it. With streaming the messages are sent as records to the PC at once
+# instead of being buffered.
 class Logger:
 
-    def __init__(self, command_handler=None):
-        self.log_buffer = []
+    def __init__(self, capacity=LOG_CAPACITY, policy=LOG_OVERWRITE_OLDEST):
+        self.log_buffer = [None] * capacity
+        self.levels = [0] * capacity
+        self.module_names = [None] * capacity
+        self.log_args = [None] * capacity
+        self.times = [0] * capacity
+        self.task_names = [None] * capacity
+        self.streaming = False
+        self.capacity = capacity
+        self.policy = policy
+        # index of the oldest message and number of messages
+        self.first = 0
+        self.count = 0
+        self.dropped = 0
+
+    # Enter a log message into the log buffer, the arguments are a tuple.
+    def log(self, level, module_name, template, args):
+        if self.streaming:
+            self.stream_record(level, module_name, template, args)
+            return
+        if self.count < self.capacity:
+            index = self.first + self.count
+            if index >= self.capacity:
+                index -= self.capacity
+            self.count += 1
+        else:
+            self.dropped += 1
+            if self.policy != LOG_OVERWRITE_OLDEST:
+                return
+            index = self.first
+            self.first += 1
+            if self.first == self.capacity:
+                self.first = 0
+        self.log_buffer[index] = template
+        self.levels[index] = level
+        self.module_names[index] = module_name
+        self.log_args[index] = args
+        self.times[index] = time_ms()
+        self.task_names[index] = current_task_name()
+
+    # Prints the message as log record for the PC.
+    def stream_record(self, level, module_name, template, args):
+        message = template
+        if len(args) > 0:
+            message = template.format(*args)
+        task_name = current_task_name()
+        print(LOG_STREAM_KEY + str(time_ms()) + "|" + LOG_LEVEL_NAMES.get(level, str(level)) + "|" +
+              ("" if task_name is None else task_name) + "|" + module_name + "|" + message)
+
+    # Returns the formatted message of the entry with the time and the task,
+    # messages of other levels than LOG_INFO contain the level name.
+    def format_message(self, index):
+        message = self.log_buffer[index]
+        args = self.log_args[index]
+        if len(args) > 0:
+            message = message.format(*args)
+        level = self.levels[index]
+        if level != LOG_INFO:
+            message = LOG_LEVEL_NAMES.get(level, str(level)) + " " + message
+        task_name = self.task_names[index]
+        if task_name is None:
+            task_name = "-"
+        return str(self.times[index]) + " " + task_name + ": " + message
 
-    # Enter a log message into the log buffer.
-    def log(self, message):
-        self.log_buffer.append(message)
+    # Returns the formatted oldest message (None: the log is empty).
+    def peek_message(self):
+        if self.count == 0:
+            return None
+        return self.format_message(self.first)
 
-    # Cleans all log messages.
+    # Removes the oldest message.
+    def remove_message(self):
+        if self.count == 0:
+            return
+        index = self.first
+        self.log_buffer[index] = None
+        self.module_names[index] = None
+        self.log_args[index] = None
+        self.task_names[index] = None
+        self.first += 1
+        if self.first == self.capacity:
+            self.first = 0
+        self.count -= 1
+
+    # Cleans all log messages, the dropped counter is reset.
     def clean_log_messages(self):
-        self.log_buffer = []
+        for index in range(self.capacity):
+            self.log_buffer[index] = None
+            self.module_names[index] = None
+            self.log_args[index] = None
+            self.task_names[index] = None
+        self.first = 0
+        self.count = 0
+        self.dropped = 0
 
-    # Retrieves all log messages.
+    # Retrieves all log messages, the oldest message first.
     def get_log_messages(self):
-        return self.log_buffer
+        messages = []
+        index = self.first
+        for i in range(self.count):
+            messages.append(self.format_message(index))
+            index += 1
+            if index == self.capacity:
+                index = 0
+        return messages
 
     # Retrieves all log messages and cleans the log buffer.
     def get_log_messages_and_clean(self):
-        messages = self.log_buffer
-        self.log_buffer = []
+        messages = self.get_log_messages()
+        self.clean_log_messages()
         return messages
 
     # Prints all log messages.
     def print_log_messages(self):
-        for message in messages:
-            print(message)
+        if self.dropped > 0:
+            print(self.dropped, "log messages dropped")
+        index = self.first
+        for i in range(self.count):
+            print(self.format_message(index))
+            index += 1
+            if index == self.capacity:
+                index = 0
 
     # Prints all log messages and cleans the log buffer.
     def print_log_messages_and_clean(self):
-        for message in self.log_buffer:
-            print(message)
-        self.log_buffer = []
+        self.print_log_messages()
+        self.clean_log_messages()
 
 # Logger initializer.
 s_logger = Logger()
\ No newline at end of file
@@ -1,20 +1,121 @@
 #******************************************************************************
 # Console handler for command processing.                                     *
 #******************************************************************************
+from pylib_async import NOT_REACHED, PRIORITY_NORMAL, WaitFor, poll_ready
 from uselect import poll
 from usys import stdin
 
 # Prompt to inform the PC that a new command can be processed.
 PROMPT = ">>> "
 
+# Pipelined protocol: the PC tags a command line with a sequence number
+# ("@12 A 1") and may send further commands before the command is processed.
+# Instead of the prompt the hub acknowledges each tagged command ("@ACK 12")
+# when the command is completed. Untagged command lines use the prompt. The
+# start of the program is announced with START_KEY, the PC forgets the
+# commands in flight then.
+SEQUENCE_KEY = "@"
+ACK_KEY = "@ACK "
+START_KEY = "@START"
+
+# Sequence number of the command line in process and True when its handler
+# completes the command later (defer_command()).
+s_sequence_number = None
+s_command_deferred = False
+
+# Maximum number of bytes that are read in one poll.
+MAX_READ_BYTES = 256
+
+# Returns the length of the UTF-8 sequence that starts with the byte.
+def utf8_sequence_length(byte):
+    if byte >= 0xF0:
+        return 4
+    if byte >= 0xE0:
+        return 3
+    if byte >= 0xC0:
+        return 2
+    return 1
+
+# Returns the length of the data without an incomplete UTF-8 sequence at the
+# end, the incomplete sequence is decoded when the next bytes are received.
+def utf8_complete_length(data):
+    length = len(data)
+    index = length - 1
+    # a sequence has up to 4 bytes, continuation bytes are 10xxxxxx
+    while index >= 0 and length - index <= 4:
+        byte = data[index]
+        if byte & 0xC0 != 0x80:
+            if index + utf8_sequence_length(byte) > length:
+                return index
+            return length
+        index -= 1
+    return length
+
+# Decodes UTF-8 data, invalid bytes are dropped and the valid text around
+# them is kept.
+def decode_utf8(data):
+    try:
+        return str(data, "utf-8")
+    except UnicodeError:
+        pass
+    # decode sequence by sequence, only on invalid data
+    text = ""
+    index = 0
+    while index < len(data):
+        sequence_length = utf8_sequence_length(data[index])
+        try:
+            text += str(data[index:index + sequence_length], "utf-8")
+            index += sequence_length
+        except UnicodeError:
+            index += 1
+    return text
+
 # Let the remote program know we are ready for a command.
 def print_prompt():
     print(PROMPT, end="")
 
+# Acknowledges a tagged command to the remote program.
+def print_ack(sequence_number):
+    print(ACK_KEY + str(sequence_number))
+
+# Called by a command handler whose command is completed later (e.g. by a
+# command task). Returns the sequence number that is passed to
+# complete_command() (None: untagged command line).
+def defer_command():
+    global s_command_deferred
+    s_command_deferred = True
+    return s_sequence_number
+
+# Completes a deferred command: a tagged command is acknowledged, otherwise
+# the prompt is shown.
+def complete_command(sequence_number):
+    if sequence_number is not None:
+        print_ack(sequence_number)
+    else:
+        print_prompt()
+
+# Returns (sequence number, command line) of a tagged command line, the
+# sequence number is None when the command line is not tagged.
+def split_sequence_number(command_line):
+    if not command_line.startswith(SEQUENCE_KEY):
+        return (None, command_line)
+    end = command_line.find(" ")
+    if end < 0:
+        end = len(command_line)
+    try:
+        sequence_number = int(command_line[len(SEQUENCE_KEY):end])
+    except ValueError:
+        return (None, command_line)
+    return (sequence_number, command_line[end + 1:])
+
 class ConsoleHandler:
 
     def __init__(self, command_handler=None):
-        self.command_buffer = ""
+        # received text, the first line is echoed up to echo_length
+        self.input_text = ""
+        self.echo_length = 0
+        # received bytes that are not decoded yet
+        self.input_bytes = b""
         if command_handler == None:
             self.command_handler = self.handle
         else:
@@ -23,27 +124,225 @@ class ConsoleHandler:
         # without blocking.
         self.keyboard = poll()
         self.keyboard.register(stdin)
-        # Let the remote program know we are ready for a command.
+        # Let the remote program know that the program has started and that
+        # we are ready for a command.
+        print(START_KEY)
         print_prompt()
 
-    # Fetch input from the PC.
+    # Fetch input from the PC. All received bytes are read (up to
+    # MAX_READ_BYTES) and all complete command lines are processed.
     def poll(self):
-        if self.keyboard.poll(0):
-            # Data have been received from the PC: Read next character.
-            next_char = str(stdin.buffer.read(1), "utf-8")
-            if next_char == "\r":
-                print("")
-                if self.command_handler(self.command_buffer):
-                    # Let the remote program know we are ready for a command.
-                    print_prompt()
-                self.command_buffer = ""
-            else:
-                print(next_char, end="")
-                self.command_buffer += next_char
+        self.read_input()
+        command_line = self.read_line()
+        while command_line is not None:
+            self.process_line(command_line)
+            command_line = self.read_line()
+
+    # Reads the received bytes, an incomplete UTF-8 sequence at the end is
+    # kept until the next bytes are received.
+    def read_input(self):
+        read_count = 0
+        while read_count < MAX_READ_BYTES and poll_ready(self.keyboard, 0):
+            # Data have been received from the PC: Read next byte.
+            self.input_bytes += stdin.buffer.read(1)
+            read_count += 1
+        if read_count == 0:
+            return
+        complete_length = utf8_complete_length(self.input_bytes)
+        if complete_length == 0:
+            return
+        self.input_text += decode_utf8(self.input_bytes[:complete_length])
+        self.input_bytes = self.input_bytes[complete_length:]
+
+    # Returns True when a complete command line has been received.
+    def has_line(self):
+        return self.input_text.find("\r") >= 0
+
+    # Returns the next complete command line (None: no complete line). The
+    # echo of the line is printed at once, an incomplete line is echoed up to
+    # the received text.
+    def read_line(self):
+        input_text = self.input_text
+        end = input_text.find("\r")
+        if end < 0:
+            if self.echo_length < len(input_text):
+                print(input_text[self.echo_length:], end="")
+                self.echo_length = len(input_text)
+            return None
+        command_line = input_text[:end]
+        print(command_line[self.echo_length:])
+        self.input_text = input_text[end + 1:]
+        self.echo_length = 0
+        return command_line
+
+    # Passes the command line to the command handler. A tagged command is
+    # acknowledged, otherwise the prompt is shown when requested. A deferred
+    # command is acknowledged by complete_command().
+    def process_line(self, command_line):
+        global s_sequence_number, s_command_deferred
+        sequence_number, command_line = split_sequence_number(command_line)
+        s_sequence_number = sequence_number
+        s_command_deferred = False
+        show_prompt = self.command_handler(command_line)
+        s_sequence_number = None
+        if s_command_deferred:
+            return
+        if sequence_number is not None:
+            print_ack(sequence_number)
+        elif show_prompt:
+            # Let the remote program know we are ready for a command.
+            print_prompt()
+
+    # Returns a condition that is reached with the next command line, a task
+    # can yield the same condition repeatedly.
+    def wait_line(self):
+        return WaitForConsoleLine(self)
 
     # Handle the command line - default implementation.
     def handle(self, command_line):
         if command_line != "":
             print("command_line = " + command_line)
         # Show the prompt when True.
-        return True
\ No newline at end of file
+        return True
+
+# Reached when a complete command line has been received, the task receives
+# the command line. The task is not tested in the loop passes, the event loop
+# wakes it when data are received on stdin.
+class WaitForConsoleLine(WaitFor):
+
+    polled = False
+
+    def __init__(self, console_handler):
+        super().__init__()
+        self.console_handler = console_handler
+        self.waiting_task = None
+
+    def subscribe(self, event_loop, task):
+        self.waiting_task = task
+        event_loop.add_input_waiter(task)
+        if self.console_handler.has_line():
+            # lines of a previous burst are waiting
+            event_loop.wake_task(task)
+
+    def unsubscribe(self, event_loop, task):
+        event_loop.remove_input_waiter(task)
+
+    def test_event(self, event_loop):
+        self.console_handler.read_input()
+        command_line = self.console_handler.read_line()
+        if command_line is None:
+            return NOT_REACHED
+        event_loop.remove_input_waiter(self.waiting_task)
+        return (True, command_line)
+
+# Command of a CommandRegistry. The args are tuples (name, type), the type is
+# a conversion function (e.g. int, str) or a dict that maps the argument text
+# to a value (e.g. the connected motors). A command with a task_name is a task
+# command: the handler returns a generator that is registered as task, the
+# task_name is formatted with the argument texts (e.g. "motor_task_{0}").
+class Command:
+
+    __slots__ = ("alias", "name", "handler", "args", "help_text",
+                 "task_name", "priority", "group", "timeout_ms")
+
+    def __init__(self, alias, name, handler, args, help_text, task_name, priority, group, timeout_ms):
+        self.alias = alias
+        self.name = name
+        self.handler = handler
+        self.args = args
+        self.help_text = help_text
+        self.task_name = task_name
+        self.priority = priority
+        self.group = group
+        self.timeout_ms = timeout_ms
+
+    # Left column of the help, e.g. "A | SWITCH_TO_A <motor>".
+    def usage(self):
+        usage = self.alias + " | " + self.name
+        for arg_name, arg_type in self.args:
+            usage += " <" + arg_name + ">"
+        return usage
+
+# Registry of the console commands. The commands are found via a dict by
+# their alias or name (case insensitive), so the dispatch does not depend on
+# the number of commands. The handle method can be passed to ConsoleHandler.
+# The help (print_help(), e.g. registered as command HELP) is generated from
+# the registered commands.
+class CommandRegistry:
+
+    def __init__(self, event_loop=None):
+        self.event_loop = event_loop
+        # commands in the order of registration for the help
+        self.commands = []
+        self.command_map = {}
+
+    # Registers a command, a command with the same alias or name is replaced.
+    # A sync handler is called with the converted arguments, it returns False
+    # when the prompt shall not be shown. A command that is processed by a
+    # task calls defer_command(), the task completes it with
+    # complete_command().
+    def add(self, alias, name, handler, args=(), help_text="", task_name=None, priority=PRIORITY_NORMAL, group=None, timeout_ms=None):
+        command = Command(alias, name, handler, args, help_text, task_name, priority, group, timeout_ms)
+        # the alias and the name can hit two different commands
+        replaced_commands = []
+        for key in (alias.upper(), name.upper()):
+            replaced_command = self.command_map.get(key)
+            if replaced_command is not None and replaced_command not in replaced_commands:
+                replaced_commands.append(replaced_command)
+        if len(replaced_commands) == 0:
+            self.commands.append(command)
+        else:
+            # the new command takes the help position of the first one
+            self.commands[self.commands.index(replaced_commands[0])] = command
+        for replaced_command in replaced_commands:
+            if replaced_command in self.commands:
+                self.commands.remove(replaced_command)
+            self.command_map.pop(replaced_command.alias.upper(), None)
+            self.command_map.pop(replaced_command.name.upper(), None)
+        self.command_map[alias.upper()] = command
+        self.command_map[name.upper()] = command
+        return command
+
+    # Prints the available commands.
+    def print_help(self):
+        usage_width = 0
+        for command in self.commands:
+            if len(command.usage()) > usage_width:
+                usage_width = len(command.usage())
+        for command in self.commands:
+            usage = command.usage()
+            print(usage, "." * (usage_width + 3 - len(usage)), command.help_text)
+
+    # Handle the command line. Returns True when the prompt shall be shown.
+    def handle(self, command_line):
+        command_tokens = command_line.split()
+        if len(command_tokens) == 0:
+            return True
+        command = self.command_map.get(command_tokens[0].upper())
+        if command is None:
+            print("unknown command", command_tokens[0])
+            return True
+        arg_tokens = command_tokens[1:]
+        arg_values = []
+        for index in range(len(command.args)):
+            arg_name, arg_type = command.args[index]
+            if index >= len(arg_tokens):
+                print(command.name, "missing argument <" + arg_name + ">")
+                return True
+            try:
+                if isinstance(arg_type, dict):
+                    arg_values.append(arg_type[arg_tokens[index]])
+                else:
+                    arg_values.append(arg_type(arg_tokens[index]))
+            except (KeyError, ValueError):
+                print(command.name, "invalid argument <" + arg_name + "> =", arg_tokens[index])
+                return True
+        if command.task_name is None:
+            return command.handler(*arg_values) is not False
+        task_name = command.task_name.format(*arg_tokens)
+        if self.event_loop.task_exists(task_name):
+            print(task_name, "is running")
+            return True
+        self.event_loop.register_task(command.handler(*arg_values), task_name,
+                                      priority=command.priority, group=command.group, timeout_ms=command.timeout_ms)
+        return True
@@ -2,14 +2,103 @@
 # Provides retrieval, calibrating and de-calibration of a motor.              *
 #******************************************************************************
 from pybricks.pupdevices import Motor
-from pylib_async import WaitFor, WaitForRelativeTime
-from pylib_bg_logger import bg_log
+from pylib_async import NOT_REACHED, WaitFor, WaitForRelativeTimeMs, loop_pass, time_ms
+from pylib_bg_logger import get_module_log
 from pylib_telemetry import print_telemetry_parameter
 
+# Group of the motor tasks in the event loop, allows to cancel all together.
+MOTOR_TASK_GROUP = "motor_tasks"
+
+s_log = get_module_log("motor")
+
+# Snapshot of the angle and the speed of a motor. The motor is read at most
+# once per loop pass, with a max_age_ms > 0 at most once in this time. All
+# conditions and the telemetry use the values of the snapshot.
+class MotorSnapshot:
+
+    __slots__ = ("motor", "max_age_ms", "angle", "speed", "sample_pass",
+                 "sample_time", "reads")
+
+    def __init__(self, motor, max_age_ms):
+        self.motor = motor
+        self.max_age_ms = max_age_ms
+        self.angle = 0
+        self.speed = 0
+        # loop pass of the last reading (-1: not valid)
+        self.sample_pass = -1
+        self.sample_time = 0
+        # number of readings of the motor
+        self.reads = 0
+
+    def refresh(self):
+        current_pass = loop_pass()
+        if self.sample_pass == current_pass:
+            return self
+        time_now = time_ms()
+        if self.sample_pass >= 0 and time_now - self.sample_time < self.max_age_ms:
+            return self
+        self.angle = self.motor.angle()
+        self.speed = self.motor.speed()
+        self.reads += 1
+        self.sample_pass = current_pass
+        self.sample_time = time_now
+        return self
+
+    # The next access reads the motor, e.g. after reset_angle().
+    def invalidate(self):
+        self.sample_pass = -1
+
+s_motor_snapshots = {}
+s_snapshot_max_age_ms = 0
+
+# Sets the staleness [ms] of the snapshots that are registered afterwards
+# (0: read once per loop pass).
+def set_snapshot_max_age(max_age_ms):
+    global s_snapshot_max_age_ms
+    s_snapshot_max_age_ms = max_age_ms
+
+# Registers a motor for snapshots, optionally with an own staleness [ms].
+def register_motor(motor, max_age_ms=None):
+    if max_age_ms is None:
+        max_age_ms = s_snapshot_max_age_ms
+    snapshot = s_motor_snapshots.get(motor)
+    if snapshot is None:
+        snapshot = MotorSnapshot(motor, max_age_ms)
+        s_motor_snapshots[motor] = snapshot
+    else:
+        snapshot.max_age_ms = max_age_ms
+    return snapshot
+
+# Returns the current snapshot of a motor, the motor is registered on demand.
+def motor_snapshot(motor):
+    snapshot = s_motor_snapshots.get(motor)
+    if snapshot is None:
+        snapshot = register_motor(motor)
+    return snapshot.refresh()
+
+def motor_angle(motor):
+    return motor_snapshot(motor).angle
+
+def motor_speed(motor):
+    return motor_snapshot(motor).speed
+
+def invalidate_motor_snapshot(motor):
+    snapshot = s_motor_snapshots.get(motor)
+    if snapshot is not None:
+        snapshot.invalidate()
+
+# Returns the number of motor readings of all snapshots.
+def motor_reads():
+    reads = 0
+    for snapshot in s_motor_snapshots.values():
+        reads += snapshot.reads
+    return reads
+
 # Retrieves a motor and return None if not found.
 def get_motor(port, motor_id=""):
     try:
         ret_val = Motor(port)
+        register_motor(ret_val)
         if motor_id != "":
             print(f"{motor_id} on {port} found")
         return ret_val
@@ -25,37 +114,46 @@ class WaitForMotorCalibrated(WaitFor):
         self.motor = motor
 
     def test_event(self, event_loop):
-        angle = self.motor.angle()
-        speed = self.motor.speed()
+        snapshot = motor_snapshot(self.motor)
+        angle = snapshot.angle
         # (condition reached, return value)
-        return ((angle < 5 and angle > -5 and speed == 0), angle)
+        if angle < 5 and angle > -5 and snapshot.speed == 0:
+            return (True, angle)
+        return NOT_REACHED
 
-# Asynchronous task for calibrating a motor.
+# Asynchronous task for calibrating a motor. The motor is stopped also when
+# the task is cancelled.
 def calibrate_motor_task(motor, motor_id="default"):
-    angle = motor.angle()
-    bg_log(f"calibrate motor {motor_id} angle = {angle}")
+    angle = motor_angle(motor)
+    s_log.info("calibrate motor {} angle = {}", motor_id, angle)
     print_telemetry_parameter(motor_id, str(angle))
     # Set the motor back zu zero position and wait until it is reached
     motor.reset_angle()
-    angle = motor.angle()
-    bg_log(f"motor absolute angle = {angle}")
+    invalidate_motor_snapshot(motor)
+    angle = motor_angle(motor)
+    s_log.info("motor absolute angle = {}", angle)
     print_telemetry_parameter(motor_id, str(angle))
-    motor.run_target(20, 0, wait=False)
-    angle = yield WaitForMotorCalibrated(motor)
-    # Stop the motor to stop controlling the position
-    motor.stop()
-    bg_log(f"calibration of motor {motor_id} done, angle = {angle}")
+    try:
+        motor.run_target(20, 0, wait=False)
+        angle = yield WaitForMotorCalibrated(motor)
+    finally:
+        # Stop the motor to stop controlling the position
+        motor.stop()
+    s_log.info("calibration of motor {} done, angle = {}", motor_id, angle)
     print_telemetry_parameter(motor_id, str(angle))
     return None
 
-# Asynchronous task for decalibrating a motor.
+# Asynchronous task for decalibrating a motor. The motor is stopped also when
+# the task is cancelled.
 def decalibrate_motor_task(motor, motor_id="default"):
-    bg_log(f"decalibrate motor {motor_id} (for test purpose)...")
+    s_log.info("decalibrate motor {} (for test purpose)...", motor_id)
     # Run the motor for some time to force a decalibration
-    motor.run(200)
-    yield WaitForRelativeTime(2)
-    motor.stop()
-    angle = motor.angle()
-    bg_log(f"decalibration of motor {motor_id} done, angle = {angle}")
+    try:
+        motor.run(200)
+        yield WaitForRelativeTimeMs(2000)
+    finally:
+        motor.stop()
+    angle = motor_angle(motor)
+    s_log.info("decalibration of motor {} done, angle = {}", motor_id, angle)
     print_telemetry_parameter(motor_id, str(angle))
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,189 @@
+#******************************************************************************
+# Runs the tasks of pylib_async on the native scheduler of Pybricks.          *
+#******************************************************************************
+from pybricks.tools import multitask, run_task, wait
+from pylib_async import (PRIORITY_NORMAL, TASK_DONE, TASK_POLLED, TASK_READY,
+                         TASK_WAITING, EventLoop, TimeoutException, WaitFor,
+                         WaitForAbsoluteTimeMs, next_loop_pass, s_sleep, time_ms)
+
+# Awaitable that is resumed in each round of the scheduler while
+# condition(value) is True. It has no wake time of its own, the rounds are
+# driven by the waits of the other coroutines.
+class WaitWhile:
+
+    def __init__(self, condition, value):
+        self.condition = condition
+        self.value = value
+
+    def __await__(self):
+        while self.condition(self.value):
+            yield
+
+def is_task_waiting(task):
+    return task.state == TASK_WAITING
+
+# Event loop with the same interface as pylib_async.EventLoop, but the tasks
+# are run by the firmware scheduler (run_task and multitask). Each task runs
+# in a slot coroutine, timers are mapped directly to the firmware wait(), so
+# a sleeping task costs nothing until its wake time. A long wait is raced
+# against the state of the task, so a cancelled task frees its slot in the
+# next round of the scheduler. Conditions without a wake time and tasks
+# waiting for events are tested every poll_time_ms.
+# The firmware scheduler has no priorities, the priority of a task is kept
+# but not used. The statistics and the dispatch latency are not measured.
+# The loop starts one slot per registered task. A task registered later takes
+# an idle slot, when no slot is idle a further slot is started, so waiting
+# tasks never block the pending tasks. Idle slots are not woken by a timer.
+class MultitaskEventLoop(EventLoop):
+
+    def __init__(self):
+        super().__init__()
+        # Registered tasks that are not running in a slot yet.
+        self.pending_tasks = []
+        # Slots without a task.
+        self.idle_slots = 0
+        self.poll_time_ms = 10
+
+    def run_ms(self, poll_time_ms):
+        self.run_tasks(poll_time_ms)
+
+    # The firmware scheduler sleeps until the next wake time on its own.
+    def run_tickless_ms(self, poll_time_ms):
+        self.run_tasks(poll_time_ms)
+
+    def run_tasks(self, poll_time_ms):
+        self.poll_time_ms = poll_time_ms
+        run_task(self.run_slots())
+
+    async def run_slots(self):
+        slots = []
+        for i in range(self.task_count):
+            slots.append(self.run_slot())
+        # the starter runs after the slots have taken the registered tasks
+        slots.append(self.run_slot_starter())
+        await multitask(*slots)
+
+    # True while a slot has to wait for a pending task.
+    def slot_is_idle(self, unused):
+        return self.task_count > 0 and len(self.pending_tasks) == 0
+
+    # True while the idle slots take all pending tasks.
+    def slots_are_sufficient(self, unused):
+        return self.task_count > 0 and len(self.pending_tasks) <= self.idle_slots
+
+    # Slot coroutine: runs one task after the other until all tasks are done.
+    async def run_slot(self):
+        while self.task_count > 0:
+            if len(self.pending_tasks) == 0:
+                self.idle_slots += 1
+                await WaitWhile(self.slot_is_idle, None)
+                self.idle_slots -= 1
+                continue
+            await self.run_slot_task(self.pending_tasks.pop(0))
+
+    # Starts a further slot when more tasks are pending than slots are idle,
+    # the new slot and the next starter run in a nested multitask.
+    async def run_slot_starter(self):
+        await WaitWhile(self.slots_are_sufficient, None)
+        if self.task_count > 0:
+            await multitask(self.run_slot(), self.run_slot_starter())
+
+    # Runs the task until it is done. A wait longer than the poll time ends
+    # early when the task is cancelled or woken meanwhile.
+    async def run_slot_task(self, task):
+        while task.state != TASK_DONE:
+            wait_time_ms = self.step_task(task)
+            if wait_time_ms > self.poll_time_ms and task.state == TASK_WAITING:
+                await multitask(wait(wait_time_ms), WaitWhile(is_task_waiting, task), race=True)
+            else:
+                await wait(wait_time_ms)
+
+    def register_task(self, task, task_name=None, event_criteria=WaitFor(), priority=PRIORITY_NORMAL, group=None, timeout_ms=None):
+        task_name = super().register_task(task, task_name, event_criteria, priority, group, timeout_ms)
+        self.pending_tasks.append(self.task_map[task_name])
+        return task_name
+
+    # Tests the condition of the task and activates the task when the
+    # condition is reached. Returns the time [ms] until the next test.
+    def step_task(self, task):
+        # The firmware rounds are not visible, each test of a task is a pass.
+        next_loop_pass()
+        self.wake_input_waiters()
+        time_now = time_ms()
+        if task.deadline is not None and task.deadline <= time_now:
+            # the task has exceeded its time limit
+            self.cancel_task(task, TimeoutException(time_now - task.start_time))
+            return 0
+        if task.state == TASK_WAITING and (task.wake_time is None or task.wake_time > time_now):
+            return self.wait_time_ms(task, time_now)
+        event_criteria = task.criteria
+        try:
+            is_event, event_value = event_criteria.test_event(self)
+        except Exception as ex:
+            event_criteria.unsubscribe(self, task)
+            self.activate_task(task, None, ex)
+            return 0
+        if is_event:
+            self.activate_task(task, event_value, None)
+            return 0
+        if not event_criteria.polled:
+            # task not activated, must wait again
+            self.wait_for(task, event_criteria, False)
+        return self.wait_time_ms(task, time_ms())
+
+    # Returns the time [ms] until the task shall be tested again. Timers are
+    # waited exactly, other conditions can be woken by events and are tested
+    # after the poll time.
+    def wait_time_ms(self, task, time_now):
+        if task.state == TASK_READY:
+            return 0
+        wait_time_ms = self.poll_time_ms
+        if task.state == TASK_WAITING and task.wake_time is not None:
+            criteria = task.criteria
+            if criteria is s_sleep or isinstance(criteria, WaitForAbsoluteTimeMs):
+                wait_time_ms = task.wake_time - time_now
+            elif task.wake_time - time_now < wait_time_ms:
+                wait_time_ms = task.wake_time - time_now
+        if task.deadline is not None and task.deadline - time_now < wait_time_ms:
+            wait_time_ms = task.deadline - time_now
+        if wait_time_ms < 0:
+            return 0
+        return wait_time_ms
+
+    # The task is not kept in lists, its slot tests it. The wake time is None
+    # when the condition has no wake time.
+    def wait_for(self, task, event_criteria, subscribe):
+        if isinstance(event_criteria, int):
+            task.criteria = s_sleep
+            task.state = TASK_WAITING
+            task.wake_time = time_ms() + event_criteria
+            return
+        if isinstance(event_criteria, float):
+            raise TypeError("sleep time must be an int [ms]")
+        task.criteria = event_criteria
+        if event_criteria.polled:
+            task.state = TASK_POLLED
+            task.wake_time = None
+            if subscribe:
+                event_criteria.subscribe(self, task)
+            return
+        task.state = TASK_WAITING
+        if subscribe:
+            event_criteria.subscribe(self, task)
+            if task.state != TASK_WAITING:
+                # task has been woken by the subscription
+                return
+        task.wake_time = event_criteria.wake_time()
+
+    def wake_task(self, task):
+        if task.state == TASK_WAITING and task.criteria is not s_sleep:
+            task.state = TASK_READY
+
+    def remove_waiting_task(self, task):
+        if task.state == TASK_WAITING or task.state == TASK_READY or task.state == TASK_POLLED:
+            task.criteria.unsubscribe(self, task)
+        if task in self.pending_tasks:
+            self.pending_tasks.remove(task)
+
+    def next_wake_time(self):
+        return None
@@ -1,13 +1,16 @@
 #******************************************************************************
 # Provides helper functions for railroad switch                               *
 #******************************************************************************
-from pylib_async import WaitForRelativeTime
-from pylib_bg_logger import bg_log
+from pylib_async import WaitForRelativeTimeMs
+from pylib_bg_logger import get_module_log
+from pylib_motor import invalidate_motor_snapshot, motor_angle
 from pylib_telemetry import print_telemetry_parameter
 
+s_log = get_module_log("switch")
+
 class Position:
-    A: Position = "A"
-    B: Position = "B"
+    A = "A"
+    B = "B"
 
 def switch_to_position(motor, target_position):
     if motor:
@@ -18,7 +21,7 @@ def switch_to_position(motor, target_position):
 
 def switch_position(motor):
     if motor:
-        angle = motor.angle()
+        angle = motor_angle(motor)
         if (35 > angle and angle > 15):
             return Position.A
         elif (-15 > angle and angle > -35):
@@ -31,14 +34,18 @@ def print_position(motor, switch_name):
 
 # Asynchronous task for switching a switch
 def switch_task(motor, switch_name, target_position):
-    bg_log("try " + switch_name + " to position " + str(target_position))
+    s_log.info("try {} to position {}", switch_name, target_position)
     if switch_position(motor) == target_position:
-        bg_log(switch_name + " already has position " + str(target_position))
+        s_log.info("{} already has position {}", switch_name, target_position)
         print_telemetry_parameter(switch_name, str(target_position))
         return None
     motor.reset_angle()
-    switch_to_position(motor, target_position)
-    yield WaitForRelativeTime(1)
-    motor.stop()
+    invalidate_motor_snapshot(motor)
+    try:
+        switch_to_position(motor, target_position)
+        yield WaitForRelativeTimeMs(1000)
+    finally:
+        # the motor is stopped also when the task is cancelled
+        motor.stop()
     print_telemetry_parameter(switch_name, str(target_position))
     return None
\ No newline at end of file
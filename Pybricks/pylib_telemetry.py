@@ -1,6 +1,8 @@
 #******************************************************************************
 # Prints telemetry parameters to the console.                                 *
 #******************************************************************************
+from pylib_async import WaitForPeriodMs
+
 s_telemetry_enabled = True
 
 # Print telemetry parameters to the console. The printing is always in
@@ -19,4 +21,18 @@ def enable_telemetry():
 # Disables telemetry printing.
 def disable_telemetry():
     global s_telemetry_enabled
-    s_telemetry_enabled = False
\ No newline at end of file
+    s_telemetry_enabled = False
+
+# Asynchronous task that prints the statistics of the event loop periodically
+# as telemetry parameters. The statistics must be enabled in the event loop.
+def stats_telemetry_task(event_loop, period_ms):
+    period = WaitForPeriodMs(period_ms)
+    while True:
+        yield period
+        loop_stats = event_loop.loop_stats
+        if loop_stats is not None:
+            print_telemetry_parameter("loop_idle", str(loop_stats.idle_percent()))
+            print_telemetry_parameter("loop_jitter", str(loop_stats.jitter()))
+        for task_name, task_stats in event_loop.task_stats_map.items():
+            print_telemetry_parameter(task_name + "_run_max", str(task_stats.run_time_max))
+            print_telemetry_parameter(task_name + "_late_max", str(task_stats.lateness_max))
\ No newline at end of file
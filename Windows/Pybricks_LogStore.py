@@ -0,0 +1,132 @@
+import argparse, datetime, json, os, time
+
+# Key of the log records that are streamed by the hub, a record is one line:
+# "%LOG%<time ms>|<level>|<task>|<module>|<message>".
+LOG_STREAM_KEY = "%LOG%"
+LOG_FILE_EXTENSION = ".log"
+INDEX_FILE_SUFFIX = "_index.json"
+MAX_FILE_BYTES = 1000000
+MAX_FILES = 10
+
+# Splits a record into (hub time [ms], level, task, module, message).
+def parse_record(record):
+    fields = record.split("|", 4)
+    if len(fields) < 5:
+        return None
+    try:
+        hub_time_ms = int(fields[0])
+    except ValueError:
+        return None
+    return (hub_time_ms, fields[1], fields[2], fields[3], fields[4])
+
+# Persists the log records of a hub in files with a maximum size. When a file
+# is full the next file is started, only the newest max_files files are kept.
+# The index file contains the PC time of the first record of each file, so a
+# time range query only reads the files that overlap the range. Each line of
+# a file is "<PC time [s]>\t<record>", each session starts a new file.
+class LogStore:
+
+    def __init__(self, directory, base_name, max_file_bytes=MAX_FILE_BYTES, max_files=MAX_FILES):
+        self.directory = directory
+        self.base_name = base_name.replace(" ", "_")
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.index_path = os.path.join(directory, self.base_name + INDEX_FILE_SUFFIX)
+        self.index = self.load_index()
+        self.file = None
+        self.file_bytes = 0
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r") as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return []
+
+    # The index is replaced at once, so it is complete also after a crash.
+    def save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(self.index, index_file, indent=1)
+        os.replace(temp_path, self.index_path)
+
+    # Appends a record with the PC time [s] of its reception.
+    def append(self, record, pc_time=None):
+        if pc_time is None:
+            pc_time = time.time()
+        line = f"{pc_time:.3f}\t{record}\n"
+        line_bytes = len(line.encode("utf-8"))
+        if self.file is None or self.file_bytes + line_bytes > self.max_file_bytes:
+            self.rotate(pc_time)
+        self.file.write(line)
+        self.file.flush()
+        self.file_bytes += line_bytes
+
+    # Starts the next file and removes the oldest files.
+    def rotate(self, pc_time):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        number = self.index[-1]["number"] + 1 if len(self.index) > 0 else 1
+        file_name = f"{self.base_name}_{number:06d}{LOG_FILE_EXTENSION}"
+        self.file = open(os.path.join(self.directory, file_name), "w", encoding="utf-8")
+        self.file_bytes = 0
+        self.index.append({"number": number, "file": file_name, "first_time": pc_time})
+        while len(self.index) > self.max_files:
+            removed_entry = self.index.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, removed_entry["file"]))
+            except OSError:
+                pass
+        self.save_index()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # Returns the records with a PC time in [start_time, end_time] as list of
+    # (PC time [s], record).
+    def query(self, start_time, end_time):
+        records = []
+        for position, entry in enumerate(self.index):
+            if entry["first_time"] > end_time:
+                break
+            if position + 1 < len(self.index) and self.index[position + 1]["first_time"] < start_time:
+                # all records of the file are older
+                continue
+            try:
+                with open(os.path.join(self.directory, entry["file"]), "r", encoding="utf-8") as log_file:
+                    for line in log_file:
+                        pc_time_text, _, record = line.rstrip("\n").partition("\t")
+                        pc_time = float(pc_time_text)
+                        if start_time <= pc_time <= end_time:
+                            records.append((pc_time, record))
+            except OSError:
+                pass
+        return records
+
+def parse_time(text, default):
+    if text is None:
+        return default
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+# Prints the persisted records of a hub in a time range.
+def main():
+    parser = argparse.ArgumentParser(description="Prints the persisted log records of a hub.")
+    parser.add_argument("directory", help="directory of the log files")
+    parser.add_argument("hub_name", help="name of the hub, e.g. \"Technic Hub 1\"")
+    parser.add_argument("--start", help="start time, ISO format (e.g. 2024-05-01T10:00)")
+    parser.add_argument("--end", help="end time, ISO format")
+    args = parser.parse_args()
+    log_store = LogStore(args.directory, args.hub_name)
+    for pc_time, record in log_store.query(parse_time(args.start, 0), parse_time(args.end, float("inf"))):
+        fields = parse_record(record)
+        pc_time_text = datetime.datetime.fromtimestamp(pc_time).isoformat(timespec="milliseconds")
+        if fields is None:
+            print(pc_time_text, record)
+        else:
+            hub_time_ms, level, task_name, module_name, message = fields
+            print(pc_time_text, hub_time_ms, level, task_name, module_name, message)
+
+if __name__ == "__main__":
+    main()
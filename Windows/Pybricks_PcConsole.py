@@ -6,6 +6,7 @@ from PySide6.QtWidgets import (QApplication, QDialog, QFrame, QGridLayout,
                                QHeaderView, QLabel, QLineEdit, QPlainTextEdit,
                                QPushButton, QTableWidget, QTableWidgetItem)
 from PySide6.QtCore import QSize, Slot
+from Pybricks_LogStore import LOG_STREAM_KEY, LogStore
 
 CONFIG_FILE_NAME = "Pybricks_PcConsole.json"
 PYBRICKS_COMMAND_EVENT_CHAR_UUID = "c5f50002-8280-46da-89f4-6d8051e4aeef"
@@ -15,6 +16,15 @@ HUB_NAMES = ["Technic Hub 1"]
 # Prompt to inform the PC that a new command can be processed.
 PROMPT = ">>> "
 PROMPT_LEN = len(PROMPT)
+# Pipelined protocol: commands are tagged with a sequence number and the hub
+# acknowledges each command, several commands can be in flight.
+SEQUENCE_KEY = "@"
+ACK_KEY = "@ACK "
+# Printed by the hub when the program starts.
+START_KEY = "@START"
+# Time [s] a command waits for a free slot, then the acknowledgement of the
+# oldest command in flight is considered lost.
+ACK_TIMEOUT = 5.0
 
 TELEMETRY_KEY = "#"
 TELEMETRY_VALUE_START = "{"
@@ -56,7 +66,9 @@ def set_button_text_color(button, color_name):
 # Encapsulates the ble client to remote control a hub.
 class HubClient:
 
-    def __init__(self, ble_client, event_char_uuid, response_handler, hub_logger):
+    # A pipeline_window > 0 enables the pipelined protocol: up to
+    # pipeline_window commands are sent without waiting for the hub.
+    def __init__(self, ble_client, event_char_uuid, response_handler, hub_logger, pipeline_window=0):
         self.ble_client = ble_client
         self.ready_event = asyncio.Event()
         self.event_char_uuid = event_char_uuid
@@ -64,6 +76,13 @@ class HubClient:
         self.response_handler = response_handler
         self.send_is_ready = False
         self.response_buffer = ""
+        self.pipeline_window = pipeline_window
+        if pipeline_window > 0:
+            self.window_semaphore = asyncio.Semaphore(pipeline_window)
+        self.write_lock = asyncio.Lock()
+        self.next_sequence_number = 1
+        # Sent commands that are not acknowledged: sequence number -> command.
+        self.in_flight_commands = {}
 
     # Checks if a prompt is in the response buffer and set the ready event
     def check_prompt(self):
@@ -71,6 +90,24 @@ class HubClient:
             if PROMPT in self.response_buffer:
                 self.ready_event.set()
 
+    # Forgets the commands in flight and frees their slots.
+    def reset_pipeline(self):
+        for i in range(len(self.in_flight_commands)):
+            self.window_semaphore.release()
+        self.in_flight_commands.clear()
+
+    # Checks if the line contains an acknowledgement and releases the command.
+    def check_ack(self, line):
+        index = line.rfind(ACK_KEY)
+        if index < 0:
+            return
+        try:
+            sequence_number = int(line[index + len(ACK_KEY):])
+        except ValueError:
+            return
+        if self.in_flight_commands.pop(sequence_number, None) is not None:
+            self.window_semaphore.release()
+
     # Callback for receiving data.
     def handle_rx(self, _, data: bytearray):
         # "write stdout" event (0x01)
@@ -87,6 +124,11 @@ class HubClient:
             elif next_char == "\n":
                 # Complete line received: check if prompt
                 self.check_prompt()
+                if self.pipeline_window > 0:
+                    if START_KEY in self.response_buffer:
+                        # the program has (re)started
+                        self.reset_pipeline()
+                    self.check_ack(self.response_buffer)
                 self.response_handler.handle_response_line(self.response_buffer)
                 self.hub_logger.log_hub("")
                 self.response_buffer = ""
@@ -111,6 +153,9 @@ class HubClient:
 
     # Sends data to the hub.
     async def send(self, data):
+        if self.pipeline_window > 0:
+            await self.send_pipelined(data)
+            return
         await self.wait_send_ready()
         # Send the data to the hub.
         await self.ble_client.write_gatt_char(
@@ -120,6 +165,35 @@ class HubClient:
         )
         self.send_is_ready = False
 
+    # Sends data tagged with a sequence number to the hub, waits only while
+    # the window of commands in flight is full. When no slot is freed within
+    # ACK_TIMEOUT the slot of the oldest command in flight is taken over.
+    async def send_pipelined(self, data):
+        try:
+            await asyncio.wait_for(self.window_semaphore.acquire(), ACK_TIMEOUT)
+        except asyncio.TimeoutError:
+            if len(self.in_flight_commands) > 0:
+                lost_sequence_number = next(iter(self.in_flight_commands))
+                lost_data = self.in_flight_commands.pop(lost_sequence_number)
+                self.hub_logger.log_local(f"error: no acknowledgement of command {lost_sequence_number} ({lost_data.decode('ascii')})")
+        # The lock keeps the order of the commands.
+        async with self.write_lock:
+            sequence_number = self.next_sequence_number
+            self.next_sequence_number += 1
+            self.in_flight_commands[sequence_number] = data
+            tag = (SEQUENCE_KEY + str(sequence_number) + " ").encode("ascii")
+            try:
+                await self.ble_client.write_gatt_char(
+                    self.event_char_uuid,
+                    b"\x06" + tag + data + b"\r",  # prepend "write stdin" command (0x06) and add "\r"
+                    response=True
+                )
+            except Exception:
+                # the command has not been sent, its slot is free again
+                if self.in_flight_commands.pop(sequence_number, None) is not None:
+                    self.window_semaphore.release()
+                raise
+
 class RemoteConsole(QDialog):
     def __init__(self, console_config_dict):
         super().__init__()
@@ -130,6 +204,8 @@ class RemoteConsole(QDialog):
         self.device = None
         self.client = None
         self.hub_client = None
+        # The log records streamed by the hub are persisted in the log directory.
+        self.log_store = LogStore(getattr(self.console_config, "logDirectory", "logs"), self.console_config.hubName)
         # view - top frame
         self.top_frame = QFrame()
         self.label_hub_name = QLabel(self.console_config.hubName)
@@ -418,7 +494,8 @@ class RemoteConsole(QDialog):
         self.device = device
 
         # Initialize the sender channel to the hub.
-        self.hub_client = HubClient(self.client, PYBRICKS_COMMAND_EVENT_CHAR_UUID, self, self)
+        self.hub_client = HubClient(self.client, PYBRICKS_COMMAND_EVENT_CHAR_UUID, self, self,
+                                    getattr(self.console_config, "pipelineWindow", 0))
 
         # Subscribe to notifications from the hub.
         await self.hub_client.start_notify()
@@ -459,6 +536,11 @@ class RemoteConsole(QDialog):
 
     # Callback for receiving a complete response line.
     def handle_response_line(self, response_line):
+        # Extract a streamed log record, it is the rest of the line.
+        index = response_line.find(LOG_STREAM_KEY)
+        if index >= 0:
+            self.log_store.append(response_line[index + len(LOG_STREAM_KEY):])
+            response_line = response_line[:index]
         # Extract telemetry parameters.
         parameters = response_line.split(TELEMETRY_KEY)
         # The first parameter is invalid.